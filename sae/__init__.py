@@ -1,5 +1,13 @@
 from .config import SaeConfig, TrainConfig
 from .sae import Sae
+from .stacked import SaeGroup, StackedSae
 from .trainer import SaeTrainer
 
-__all__ = ["Sae", "SaeConfig", "SaeTrainer", "TrainConfig"]
+__all__ = [
+    "Sae",
+    "SaeConfig",
+    "SaeGroup",
+    "SaeTrainer",
+    "StackedSae",
+    "TrainConfig",
+]
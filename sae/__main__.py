@@ -1,15 +1,20 @@
 import os
 from contextlib import nullcontext, redirect_stdout
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from multiprocessing import cpu_count
 
 import torch
 import torch.distributed as dist
-from datasets import Dataset, load_dataset
-from simple_parsing import field, parse
+from datasets import Dataset, IterableDataset, load_dataset
+from datasets.distributed import split_dataset_by_node
+from simple_parsing import field, list_field, parse
 from transformers import AutoModel, AutoTokenizer, BitsAndBytesConfig, PreTrainedModel
 
-from .data import chunk_and_tokenize
+from .data import (
+    StreamingTokenDataset,
+    chunk_and_tokenize,
+    chunk_and_tokenize_streaming,
+)
 from .trainer import SaeTrainer, TrainConfig
 
 
@@ -30,6 +35,10 @@ class RunConfig(TrainConfig):
     split: str = "train"
     """Dataset split to use for training."""
 
+    streaming: bool = False
+    """Stream and tokenize the dataset on the fly, instead of preprocessing it all up
+    front. Requires `max_examples` to be set."""
+
     ctx_len: int = 2048
     """Context length to use for training."""
 
@@ -44,10 +53,32 @@ class RunConfig(TrainConfig):
     )
     """Number of processes to use for preprocessing data"""
 
+    sweep_k: list[int] = list_field()
+    """Values of `k` to sweep over, training one SAE per value on each hookpoint."""
+
+    sweep_expansion_factor: list[int] = list_field()
+    """Expansion factors to sweep over. Combined with `sweep_k` if both are set."""
+
+    def __post_init__(self):
+        super().__post_init__()
+
+        if self.sweep_k or self.sweep_expansion_factor:
+            self.sweep = [
+                replace(self.sae, k=k, expansion_factor=expansion_factor)
+                for k in self.sweep_k or [self.sae.k]
+                for expansion_factor in self.sweep_expansion_factor
+                or [self.sae.expansion_factor]
+            ]
 
-def load_artifacts(args: RunConfig, rank: int) -> tuple[PreTrainedModel, Dataset]:
+
+def load_artifacts(
+    args: RunConfig, device: str
+) -> tuple[PreTrainedModel, Dataset | StreamingTokenDataset]:
     if args.load_in_8bit:
         dtype = torch.float16
+    elif device == "cpu":
+        # Half precision matmuls are slow or unsupported on most CPUs
+        dtype = torch.float32
     elif torch.cuda.is_bf16_supported():
         dtype = torch.bfloat16
     else:
@@ -55,7 +86,7 @@ def load_artifacts(args: RunConfig, rank: int) -> tuple[PreTrainedModel, Dataset
 
     model = AutoModel.from_pretrained(
         args.model,
-        device_map={"": f"cuda:{rank}"},
+        device_map={"": device},
         quantization_config=(
             BitsAndBytesConfig(load_in_8bit=args.load_in_8bit)
             if args.load_in_8bit
@@ -65,6 +96,27 @@ def load_artifacts(args: RunConfig, rank: int) -> tuple[PreTrainedModel, Dataset
         token=args.hf_token,
     )
 
+    if args.streaming:
+        dataset = load_dataset(
+            args.dataset,
+            split=args.split,
+            streaming=True,
+            trust_remote_code=True,
+        )
+        assert isinstance(dataset, IterableDataset)
+        if dist.is_initialized():
+            dataset = split_dataset_by_node(
+                dataset, rank=dist.get_rank(), world_size=dist.get_world_size()
+            )
+
+        tokenizer = AutoTokenizer.from_pretrained(args.model, token=args.hf_token)
+        return model, chunk_and_tokenize_streaming(
+            dataset,
+            tokenizer,
+            max_seq_len=args.ctx_len,
+            num_proc=args.data_preprocessing_num_proc,
+        )
+
     try:
         dataset = load_dataset(
             args.dataset,
@@ -94,28 +146,63 @@ def load_artifacts(args: RunConfig, rank: int) -> tuple[PreTrainedModel, Dataset
     return model, dataset
 
 
+def pin_threads(local_rank: int, local_world_size: int):
+    """Give each process on this node its own share of the CPU cores."""
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        per_rank = max(len(cores) // local_world_size, 1)
+        start = (local_rank * per_rank) % len(cores)
+
+        os.sched_setaffinity(0, cores[start : start + per_rank])
+    else:
+        per_rank = max(cpu_count() // local_world_size, 1)
+
+    torch.set_num_threads(per_rank)
+
+
 def run():
     local_rank = os.environ.get("LOCAL_RANK")
     ddp = local_rank is not None
-    rank = int(local_rank) if ddp else 0
-
-    if ddp:
-        torch.cuda.set_device(int(local_rank))
-        dist.init_process_group("nccl")
+    local_rank = int(local_rank) if ddp else 0
 
-        if rank == 0:
-            print(f"Using DDP across {dist.get_world_size()} GPUs.")
+    # Without GPUs, run one process per group of CPU cores and communicate with gloo
+    cuda = torch.cuda.is_available()
+    device = f"cuda:{local_rank}" if cuda else "cpu"
 
+    if ddp:
+        if cuda:
+            torch.cuda.set_device(local_rank)
+            dist.init_process_group("nccl")
+        else:
+            pin_threads(local_rank, int(os.environ.get("LOCAL_WORLD_SIZE", 1)))
+            dist.init_process_group("gloo")
+
+        if dist.get_rank() == 0:
+            if cuda:
+                print(f"Using DDP across {dist.get_world_size()} GPUs.")
+            else:
+                print(
+                    f"Using DDP across {dist.get_world_size()} CPU processes with "
+                    f"{torch.get_num_threads()} threads each."
+                )
+
+    rank = dist.get_rank() if ddp else 0
     args = parse(RunConfig)
 
     # Awkward hack to prevent other ranks from duplicating data preprocessing
-    if not ddp or rank == 0:
-        model, dataset = load_artifacts(args, rank)
+    if not ddp or local_rank == 0:
+        model, dataset = load_artifacts(args, device)
     if ddp:
         dist.barrier()
-        if rank != 0:
-            model, dataset = load_artifacts(args, rank)
-        dataset = dataset.shard(dist.get_world_size(), rank)
+        if local_rank != 0:
+            model, dataset = load_artifacts(args, device)
+
+        # Streaming datasets are split between ranks before tokenization
+        if isinstance(dataset, Dataset):
+            # Drop the remainder so that the batches of every rank line up
+            world_size = dist.get_world_size()
+            dataset = dataset.select(range(len(dataset) // world_size * world_size))
+            dataset = dataset.shard(world_size, rank)
 
     # Prevent ranks other than 0 from printing
     with nullcontext() if rank == 0 else redirect_stdout(None):
@@ -0,0 +1,244 @@
+"""Benchmark the SAE forward and backward passes over a grid of shapes.
+
+Run with `python -m sae.benchmark --help` to see the available options. Results are
+appended to a JSON Lines file, one record per point in the grid.
+"""
+
+import json
+import multiprocessing
+import resource
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import product
+from typing import Callable
+
+import torch
+from simple_parsing import Serializable, list_field, parse
+
+from .config import SaeConfig
+from .sae import Sae
+from .utils import available_decoders, dtype_to_str, set_decoder, str_to_dtype
+
+
+@dataclass
+class BenchConfig(Serializable):
+    d_in: list[int] = list_field(768)
+    """Input widths to benchmark."""
+
+    num_latents: list[int] = list_field(768 * 8, 768 * 32)
+    """Numbers of latents to benchmark."""
+
+    k: list[int] = list_field(32, 128)
+    """Numbers of nonzero latents to benchmark."""
+
+    batch_size: list[int] = list_field(4096)
+    """Batch sizes to benchmark, measured in tokens."""
+
+    dtype: list[str] = list_field("float32")
+    """Names of the dtypes to benchmark, like `float32` or `bfloat16`."""
+
+    decoders: list[str] = list_field()
+    """Decoder backends to benchmark. If empty, use the default backend."""
+
+    device: str = "cuda" if torch.cuda.is_available() else "cpu"
+
+    warmup: int = 1
+    """Number of untimed iterations to run before timing each phase."""
+
+    repeats: int = 5
+    """Number of timed iterations for each phase. We report the median."""
+
+    output: str = "benchmark.jsonl"
+    """File to append results to."""
+
+
+def resident_memory() -> int:
+    """Current resident set size of this process in bytes. Linux only."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def peak_memory(device: torch.device) -> int:
+    """Peak memory usage in bytes.
+
+    On CUDA this is the peak allocated since the last reset. On CPU, it's the peak
+    resident set size of the whole process, which never goes down. Use
+    `benchmark_in_subprocess` to measure a single configuration on CPU.
+    """
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device)
+
+    # Linux reports kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def time_phase(
+    fn: Callable[[], object], device: torch.device, warmup: int, repeats: int
+) -> float:
+    """Median wall clock time of `fn` in milliseconds."""
+
+    def sync():
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+
+    times = []
+    for i in range(warmup + repeats):
+        sync()
+        start = time.perf_counter()
+        fn()
+        sync()
+
+        if i >= warmup:
+            times.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(times)
+
+
+def benchmark(
+    d_in: int,
+    num_latents: int,
+    k: int,
+    batch_size: int,
+    dtype: torch.dtype,
+    device: torch.device | str,
+    *,
+    warmup: int = 1,
+    repeats: int = 5,
+) -> dict:
+    """Benchmark every phase of an SAE training step for a single configuration.
+
+    On CPU, the reported peak memory is relative to the resident memory at the start
+    of the call, and is only meaningful if this process hasn't already exceeded it.
+    """
+    device = torch.device(device)
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        baseline = 0
+    else:
+        baseline = resident_memory()
+
+    cfg = SaeConfig(num_latents=num_latents, k=k)
+    sae = Sae(d_in, cfg, device=device, dtype=dtype)
+    optimizer = torch.optim.Adam(sae.parameters(), lr=1e-4)
+
+    x = torch.randn(batch_size, d_in, device=device, dtype=dtype)
+    dead_mask = torch.rand(num_latents, device=device) < 0.5
+
+    with torch.no_grad():
+        pre_acts = sae.pre_acts(x)
+        top_acts, top_indices = sae.select_topk(pre_acts)
+
+    def train_step():
+        out = sae(x, dead_mask=dead_mask)
+        (out.fvu + out.auxk_loss).backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+    def backward():
+        # Includes the forward pass, which we subtract out below
+        out = sae(x, dead_mask=dead_mask)
+        (out.fvu + out.auxk_loss).backward()
+
+    # Populate the gradients so that `optimizer.step` has something to do
+    backward()
+
+    latency = {}
+    with torch.no_grad():
+        latency["encode"] = time_phase(lambda: sae.pre_acts(x), device, warmup, repeats)
+        latency["select_topk"] = time_phase(
+            lambda: sae.select_topk(pre_acts), device, warmup, repeats
+        )
+        latency["decode"] = time_phase(
+            lambda: sae.decode(top_acts, top_indices), device, warmup, repeats
+        )
+        latency["forward"] = time_phase(lambda: sae(x), device, warmup, repeats)
+        latency["forward_auxk"] = time_phase(
+            lambda: sae(x, dead_mask=dead_mask), device, warmup, repeats
+        )
+
+    latency["backward"] = max(
+        time_phase(backward, device, warmup, repeats) - latency["forward_auxk"], 0.0
+    )
+    latency["optimizer_step"] = time_phase(optimizer.step, device, warmup, repeats)
+    optimizer.zero_grad()
+    latency["train_step"] = time_phase(train_step, device, warmup, repeats)
+
+    return {
+        "d_in": d_in,
+        "num_latents": num_latents,
+        "k": k,
+        "batch_size": batch_size,
+        "dtype": dtype_to_str(dtype),
+        "device": str(device),
+        "tokens_per_sec": batch_size / (latency["train_step"] / 1000),
+        "peak_memory_bytes": max(peak_memory(device) - baseline, 0),
+        "latency_ms": latency,
+    }
+
+
+def benchmark_with_decoder(decoder: str, *args, **kwargs) -> dict:
+    """Run `benchmark` using the given decoder backend."""
+    set_decoder(decoder)
+    try:
+        return benchmark(*args, **kwargs)
+    finally:
+        set_decoder("default")
+
+
+def benchmark_in_subprocess(decoder: str, *args, **kwargs) -> dict:
+    """Run `benchmark_with_decoder` in a fresh process.
+
+    The peak resident set size of a process never goes down, so this is the only way
+    to measure the peak CPU memory of each configuration separately.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+        return pool.submit(benchmark_with_decoder, decoder, *args, **kwargs).result()
+
+
+def run():
+    cfg = parse(BenchConfig)
+    device = torch.device(cfg.device)
+    decoders = cfg.decoders or ["default"]
+
+    for name in decoders:
+        if name != "default" and name not in available_decoders(device):
+            raise ValueError(f"Decoder '{name}' is not available on {device}")
+
+    grid = product(
+        decoders, cfg.d_in, cfg.num_latents, cfg.k, cfg.batch_size, cfg.dtype
+    )
+    with open(cfg.output, "a") as f:
+        for decoder, d_in, num_latents, k, batch_size, dtype in grid:
+            # CUDA peak memory can be reset between points, but on CPU we need a
+            # new process for each one
+            fn = (
+                benchmark_with_decoder
+                if device.type == "cuda"
+                else benchmark_in_subprocess
+            )
+            result = fn(
+                decoder,
+                d_in,
+                num_latents,
+                k,
+                batch_size,
+                str_to_dtype(dtype),
+                device,
+                warmup=cfg.warmup,
+                repeats=cfg.repeats,
+            )
+
+            result["decoder"] = decoder
+            print(
+                f"{decoder=} {d_in=} {num_latents=} {k=} {batch_size=} {dtype=}: "
+                f"{result['tokens_per_sec']:,.0f} tokens/sec"
+            )
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,138 @@
+"""On-disk cache of language model activations."""
+
+import json
+from itertools import islice
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+from torch import Tensor
+
+from .utils import MANIFEST_NAME, dtype_to_str, map_tensor, str_to_dtype, write_tensor
+
+
+class ActivationCacheWriter:
+    """Write the activations captured at each hookpoint to sharded binary files.
+
+    Each hookpoint gets its own directory containing one flat file per shard, and
+    each shard holds `shard_size` consecutive batches. The `manifest.json` file is
+    only written by `close()`, so an interrupted run never leaves behind a cache that
+    looks complete.
+    """
+
+    def __init__(self, root: Path | str, shard_size: int = 64):
+        self.root = Path(root)
+        self.shard_size = shard_size
+
+        self.files: dict[str, BinaryIO] = {}
+        self.hookpoints: dict[str, dict] = {}
+        self.batch_tokens: list[int] = []
+
+        # Remove any manifest left over from a previous, now overwritten, cache
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.root.joinpath(MANIFEST_NAME).unlink(missing_ok=True)
+
+    def write(self, hidden_dict: dict[str, Tensor]):
+        """Append one batch of `(num_tokens, width)` activations for every hookpoint."""
+        num_tokens = {x.shape[0] for x in hidden_dict.values()}
+        assert (
+            len(num_tokens) == 1
+        ), "All hookpoints must have the same number of tokens"
+
+        if self.batch_tokens and len(self.batch_tokens) % self.shard_size == 0:
+            self._close_files()
+
+        for name, hiddens in hidden_dict.items():
+            assert hiddens.ndim == 2, "Expected activations of shape (tokens, width)"
+            meta = self.hookpoints.setdefault(
+                name,
+                {"width": hiddens.shape[-1], "dtype": dtype_to_str(hiddens.dtype)},
+            )
+            assert meta["width"] == hiddens.shape[-1], f"Width changed for '{name}'"
+
+            if name not in self.files:
+                shard = len(self.batch_tokens) // self.shard_size
+                path = self.root / name / f"{shard:05d}.bin"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self.files[name] = open(path, "wb")
+
+            write_tensor(self.files[name], hiddens)
+
+        self.batch_tokens.extend(num_tokens)
+
+    def close(self):
+        """Flush all shards and write the manifest, marking the cache as complete."""
+        self._close_files()
+
+        with open(self.root / MANIFEST_NAME, "w") as f:
+            json.dump(
+                {
+                    "hookpoints": self.hookpoints,
+                    "shard_size": self.shard_size,
+                    "batch_tokens": self.batch_tokens,
+                },
+                f,
+            )
+
+    def _close_files(self):
+        for f in self.files.values():
+            f.close()
+
+        self.files.clear()
+
+
+class ActivationCache:
+    """Read activations written by `ActivationCacheWriter`.
+
+    Shards are memory-mapped, so iterating over the cache yields views into the page
+    cache rather than copies. Batches come back in the order they were written.
+    """
+
+    def __init__(self, root: Path | str):
+        self.root = Path(root)
+
+        with open(self.root / MANIFEST_NAME, "r") as f:
+            manifest = json.load(f)
+
+        self.hookpoints: dict[str, dict] = manifest["hookpoints"]
+        self.shard_size: int = manifest["shard_size"]
+        self.batch_tokens: list[int] = manifest["batch_tokens"]
+
+    @staticmethod
+    def exists(root: Path | str) -> bool:
+        """Check whether a complete cache exists at `root`."""
+        return Path(root).joinpath(MANIFEST_NAME).exists()
+
+    @property
+    def num_shards(self) -> int:
+        return -(-len(self.batch_tokens) // self.shard_size)
+
+    def __len__(self) -> int:
+        return len(self.batch_tokens)
+
+    def __iter__(self) -> Iterator[dict[str, Tensor]]:
+        return self.iter_batches()
+
+    def iter_batches(self, start: int = 0) -> Iterator[dict[str, Tensor]]:
+        """Yield the batches in order, skipping straight to batch `start`."""
+        first_shard, skip = divmod(start, self.shard_size)
+        for shard in range(first_shard, self.num_shards):
+            batches = self.iter_shard(shard)
+            yield from islice(batches, skip, None) if shard == first_shard else batches
+
+    def iter_shard(self, shard: int) -> Iterator[dict[str, Tensor]]:
+        """Yield the batches stored in a single shard."""
+        lengths = self.batch_tokens[
+            shard * self.shard_size : (shard + 1) * self.shard_size
+        ]
+        mapped = {
+            name: map_tensor(
+                self.root / name / f"{shard:05d}.bin",
+                str_to_dtype(meta["dtype"]),
+                (sum(lengths), meta["width"]),
+            )
+            for name, meta in self.hookpoints.items()
+        }
+        splits = {name: x.split(lengths) for name, x in mapped.items()}
+
+        for j in range(len(lengths)):
+            yield {name: chunks[j] for name, chunks in splits.items()}
@@ -0,0 +1,198 @@
+"""Write checkpoints in the background, so that training doesn't have to wait."""
+
+import json
+import os
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import torch
+from safetensors.torch import save_file
+from torch import Tensor
+
+
+def to_host(obj: Any, pin: bool = False) -> Any:
+    """Copy every tensor in a nested structure of dicts, lists and tuples to the CPU.
+
+    Tensors already on the CPU are copied too, so that the result is unaffected by
+    later in-place updates. If `pin` is set, tensors on the GPU are copied into
+    page-locked memory without blocking; synchronize before reading the copies.
+    """
+    if isinstance(obj, Tensor):
+        pin = pin and obj.device.type == "cuda"
+        buffer = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=pin)
+        return buffer.copy_(obj.detach(), non_blocking=pin)
+    if isinstance(obj, dict):
+        return {k: to_host(v, pin) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_host(v, pin) for v in obj)
+
+    return obj
+
+
+def recover_checkpoint(root: Path | str):
+    """Finish swapping in a checkpoint root, if we were interrupted while doing so.
+
+    The old root is moved aside just before the new one is moved into place, so if
+    `root` is missing but an old copy exists, the staged copy next to it is complete.
+    """
+    root = Path(root)
+    if root.exists():
+        return
+
+    for old in root.parent.glob(f"{root.name}.tmp-*.old"):
+        staging = old.with_name(old.name.removesuffix(".old"))
+        if staging.exists():
+            staging.rename(root)
+            shutil.rmtree(old)
+        else:
+            old.rename(root)
+        return
+
+
+class CheckpointWriter:
+    """Write checkpoints from a pool of background threads.
+
+    `save` snapshots the tensors to host memory and returns right away. Each directory
+    of the checkpoint is then written by its own thread into a staging copy of the
+    checkpoint root, which replaces the old root in a single swap once every file is
+    complete, so a partially written or mixed checkpoint is never visible. At most one
+    checkpoint is in flight: `save` waits for the previous one to finish first.
+
+    If several processes each write part of every checkpoint, construct a writer in
+    each of them with the same `num_writers` and `session`, and a distinct `rank`.
+    They then share a staging root, and the last one to finish swaps it in.
+    """
+
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        *,
+        num_writers: int = 1,
+        rank: int = 0,
+        session: str | None = None,
+    ):
+        assert num_writers == 1 or session is not None, "Writers must share a session"
+
+        self.pool = ThreadPoolExecutor(max_workers, thread_name_prefix="checkpoint")
+        self.pending: list[Future] = []
+        self.staging: Path | None = None
+
+        self.num_writers = num_writers
+        self.rank = rank
+        self.session = session or str(os.getpid())
+        self.num_saves = 0
+
+    def save(
+        self,
+        root: Path | str,
+        dirs: dict[str, dict[str, Any]],
+        manifest: dict[str, Any] | None = None,
+    ):
+        """Write each subdirectory of `root` in `dirs` in the background.
+
+        `dirs` maps each subdirectory to a dictionary of its files. The contents of a
+        file should be a dictionary of tensors if its name ends with `.safetensors`, a
+        picklable object if it ends with `.pt`, and a JSON-serializable object
+        otherwise. If given, `manifest` is written to `checkpoint.json` in `root`. It
+        must be the same for every writer, since only one of them writes it.
+        """
+        self.wait()
+
+        cuda = torch.cuda.is_available()
+        snapshot = to_host(dirs, pin=cuda)
+
+        # Lets the writers wait for the copies to the host to finish
+        event = None
+        if cuda:
+            event = torch.cuda.Event()
+            event.record()
+
+        # Every writer saves at the same points, so they agree on this name
+        root = Path(root)
+        self.staging = root.with_name(
+            f"{root.name}.tmp-{self.session}-{self.num_saves}"
+        )
+        self.num_saves += 1
+
+        writes = [
+            self.pool.submit(self._write, self.staging / name, files, event)
+            for name, files in snapshot.items()
+        ]
+        self.pending = [
+            self.pool.submit(self._commit, root, self.staging, writes, manifest)
+        ]
+
+    def wait(self):
+        """Block until the checkpoint in flight, if any, is completely written."""
+        try:
+            for future in self.pending:
+                future.result()
+        except BaseException:
+            # Other writers may still be using the staging root, but after an error
+            # this checkpoint will never be complete anyway
+            if self.staging is not None:
+                shutil.rmtree(self.staging, ignore_errors=True)
+            raise
+        finally:
+            self.pending = []
+            self.staging = None
+
+    def close(self):
+        self.wait()
+        self.pool.shutdown()
+
+    def _commit(
+        self,
+        root: Path,
+        staging: Path,
+        writes: list[Future],
+        manifest: dict[str, Any] | None = None,
+    ):
+        for future in writes:
+            future.result()
+
+        # The last writer to finish swaps the staging root in. Creating a directory is
+        # atomic, so exactly one of them gets to do it even if they finish together.
+        # The lock is held until the swap is done, after which the staging root no
+        # longer exists, so a writer that saw every marker too can never take it.
+        staging.mkdir(parents=True, exist_ok=True)
+        (staging / f".done-{self.rank}").touch()
+        if len(list(staging.glob(".done-*"))) < self.num_writers:
+            return
+        try:
+            (staging / ".commit").mkdir()
+        except (FileExistsError, FileNotFoundError):
+            return
+
+        if manifest is not None:
+            with open(staging / "checkpoint.json", "w") as f:
+                json.dump(manifest, f)
+
+        if root.exists():
+            old = staging.with_name(f"{staging.name}.old")
+            root.rename(old)
+            staging.rename(root)
+            shutil.rmtree(old)
+        else:
+            staging.rename(root)
+
+        for marker in root.glob(".done-*"):
+            marker.unlink()
+        (root / ".commit").rmdir()
+
+    @staticmethod
+    def _write(path: Path, files: dict[str, Any], event: Any | None = None):
+        if event is not None:
+            event.synchronize()
+
+        path.mkdir(parents=True, exist_ok=True)
+        for name, contents in files.items():
+            if name.endswith(".safetensors"):
+                save_file(contents, path / name)
+            elif name.endswith(".pt"):
+                torch.save(contents, path / name)
+            else:
+                with open(path / name, "w") as f:
+                    json.dump(contents, f)
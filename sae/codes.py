@@ -0,0 +1,309 @@
+"""Compact on-disk storage for the sparse codes of a corpus."""
+
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator
+
+import torch
+from torch import Tensor
+from transformers import PreTrainedModel
+
+from .sae import EncoderOutput, Sae
+from .stacked import SaeGroup
+from .utils import (
+    MANIFEST_NAME,
+    HookpointCapture,
+    dtype_to_str,
+    map_tensor,
+    str_to_dtype,
+    write_tensor,
+)
+
+DOCUMENTS_NAME = "documents.bin"
+
+
+def index_dtype(num_latents: int) -> torch.dtype:
+    """Narrowest dtype that can hold the index of every latent."""
+    # PyTorch supports few ops on uint32, so we go straight to int32 after uint16
+    return torch.uint16 if num_latents <= 2**16 else torch.int32
+
+
+@torch.no_grad()
+def iter_codes(
+    model: PreTrainedModel, saes: dict[str, Sae], batches: Iterable[Tensor]
+) -> Iterator[dict[str, EncoderOutput]]:
+    """Encode the activations of the model on each batch of token ids.
+
+    `saes` is keyed by hookpoint, as returned by `Sae.load_many_from_hub`. For each
+    `(batch_size, seq_len)` batch, yields the codes of every hookpoint, each of shape
+    `(batch_size, seq_len, k)`. The model is only run up to the last hookpoint, and
+    all of the SAEs are encoded together with a `SaeGroup`.
+    """
+    group = SaeGroup(saes)
+    with HookpointCapture(model, saes) as capture:
+        for input_ids in batches:
+            yield group.encode(capture(input_ids.to(model.device, non_blocking=True)))
+
+
+class CodeWriter:
+    """Write the sparse codes of each hookpoint to sharded binary files.
+
+    Each hookpoint gets its own directory, holding one file of latent indices and one
+    of activations per shard. Indices are stored in the narrowest integer dtype that
+    fits `num_latents`, and activations in `value_dtype` if it is given. A new shard
+    is started once the current one holds at least `shard_tokens` tokens.
+
+    The token offset at which each document starts is appended to `documents.bin`,
+    followed by the total number of tokens on `close()`. Like `ActivationCacheWriter`,
+    the manifest is only written by `close()`. It gives each shard a random id, which
+    changes whenever the shard is written again, so that anything derived from a shard
+    can tell when it is out of date.
+
+    If `append` is set and `root` holds a complete export, new codes are added to it
+    in new shards, leaving the existing ones untouched. They are stored in the same
+    dtypes as the existing codes, and the export stays readable as it was until the
+    new manifest replaces the old one on `close()`.
+    """
+
+    def __init__(
+        self,
+        root: Path | str,
+        num_latents: dict[str, int],
+        *,
+        value_dtype: torch.dtype | None = None,
+        shard_tokens: int = 2**24,
+        append: bool = False,
+    ):
+        self.root = Path(root)
+        self.num_latents = num_latents
+        self.value_dtype = value_dtype
+        self.shard_tokens = shard_tokens
+
+        self.files: dict[str, tuple[BinaryIO, BinaryIO]] = {}
+        self.hookpoints: dict[str, dict] = {}
+        self.shard_lengths: list[int] = []
+        self.shard_ids: list[str] = []
+        self.num_docs = 0
+
+        append = append and SparseCodes.exists(self.root)
+        if append:
+            codes = SparseCodes(self.root)
+            stored = {
+                name: meta["num_latents"] for name, meta in codes.hookpoints.items()
+            }
+            if stored != num_latents:
+                raise ValueError(
+                    f"Can't append codes for {num_latents} to an export of {stored}"
+                )
+
+            dtypes = {meta["value_dtype"] for meta in codes.hookpoints.values()}
+            if value_dtype is not None and dtypes != {dtype_to_str(value_dtype)}:
+                raise ValueError(
+                    f"Can't append {value_dtype} codes to an export of {dtypes} codes"
+                )
+
+            self.hookpoints = codes.hookpoints
+            self.shard_lengths = codes.shard_lengths
+            self.shard_ids = codes.shard_ids
+            self.num_docs = codes.num_docs
+
+            # The first new document starts where the last one ended, so we can write
+            # over the end offset without changing what the old manifest refers to
+            self.doc_file = open(self.root / DOCUMENTS_NAME, "r+b")
+            self.doc_file.seek(self.num_docs * torch.long.itemsize)
+        else:
+            # Remove the manifest, since the export is incomplete until we're done
+            self.root.mkdir(parents=True, exist_ok=True)
+            self.root.joinpath(MANIFEST_NAME).unlink(missing_ok=True)
+            self.doc_file = open(self.root / DOCUMENTS_NAME, "wb")
+
+    @property
+    def num_tokens(self) -> int:
+        return sum(self.shard_lengths)
+
+    def write(
+        self,
+        codes: dict[str, EncoderOutput],
+        doc_lengths: Iterable[int] | None = None,
+    ):
+        """Append the codes of one batch of tokens for every hookpoint.
+
+        Codes of shape `(batch_size, seq_len, k)` are treated as `batch_size`
+        documents, unless `doc_lengths` says otherwise. Codes of shape
+        `(num_tokens, k)` are one document by default.
+        """
+        assert codes.keys() == self.num_latents.keys(), "Missing or extra hookpoints"
+
+        shapes = {acts.shape[:-1] for acts, _ in codes.values()}
+        assert len(shapes) == 1, "All hookpoints must have the same number of tokens"
+
+        (shape,) = shapes
+        num_tokens = shape.numel()
+        if doc_lengths is None:
+            doc_lengths = [shape[-1]] * shape[0] if len(shape) > 1 else [num_tokens]
+
+        doc_lengths = torch.tensor(list(doc_lengths), dtype=torch.long)
+        assert doc_lengths.sum() == num_tokens, "Documents must cover every token"
+
+        # Every writer starts a new shard, so that existing shards are never modified
+        if not self.files or self.shard_lengths[-1] >= self.shard_tokens:
+            self._close_files()
+            self.shard_lengths.append(0)
+            self.shard_ids.append(uuid.uuid4().hex)
+
+        for name, (top_acts, top_indices) in codes.items():
+            num_latents = self.num_latents[name]
+            meta = self.hookpoints.setdefault(
+                name,
+                {
+                    "num_latents": num_latents,
+                    "k": top_acts.shape[-1],
+                    "index_dtype": dtype_to_str(index_dtype(num_latents)),
+                    "value_dtype": dtype_to_str(self.value_dtype or top_acts.dtype),
+                },
+            )
+            assert meta["k"] == top_acts.shape[-1], f"k changed for '{name}'"
+
+            # Use the stored dtypes, which may come from an earlier writer
+            values = top_acts.to(str_to_dtype(meta["value_dtype"]))
+            indices = top_indices.to(str_to_dtype(meta["index_dtype"]))
+
+            if name not in self.files:
+                shard = len(self.shard_lengths) - 1
+                path = self.root / name / f"{shard:05d}"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self.files[name] = (
+                    open(path.with_suffix(".acts.bin"), "wb"),
+                    open(path.with_suffix(".indices.bin"), "wb"),
+                )
+
+            for f, x in zip(self.files[name], (values, indices)):
+                write_tensor(f, x)
+
+        starts = self.num_tokens + doc_lengths.cumsum(0) - doc_lengths
+        write_tensor(self.doc_file, starts)
+        self.num_docs += len(doc_lengths)
+        self.shard_lengths[-1] += num_tokens
+
+    def close(self):
+        """Flush all shards and write the manifest, marking the export as complete."""
+        self._close_files()
+
+        # End the last document, and drop anything left over from an earlier writer
+        write_tensor(self.doc_file, torch.tensor([self.num_tokens]))
+        self.doc_file.truncate()
+        self.doc_file.close()
+
+        # Replace the manifest atomically, so a reader sees either export but never a
+        # mix of the two
+        tmp = self.root / f"{MANIFEST_NAME}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {
+                    "hookpoints": self.hookpoints,
+                    "shard_lengths": self.shard_lengths,
+                    "shard_ids": self.shard_ids,
+                    "num_docs": self.num_docs,
+                },
+                f,
+            )
+        os.replace(tmp, self.root / MANIFEST_NAME)
+
+    def _close_files(self):
+        for files in self.files.values():
+            for f in files:
+                f.close()
+
+        self.files.clear()
+
+
+class SparseCodes:
+    """Read the codes written by `CodeWriter`.
+
+    Shards are memory-mapped, and everything returned is a view into the page cache
+    rather than a copy, except for token ranges that span several shards. Indices come
+    back in the dtype they were stored in, so convert them with `.long()` before using
+    them to index other tensors.
+    """
+
+    def __init__(self, root: Path | str):
+        self.root = Path(root)
+
+        with open(self.root / MANIFEST_NAME, "r") as f:
+            manifest = json.load(f)
+
+        self.hookpoints: dict[str, dict] = manifest["hookpoints"]
+        self.shard_lengths: list[int] = manifest["shard_lengths"]
+        self.shard_ids: list[str] = manifest["shard_ids"]
+
+        # Token offset of the start of each shard, and of the end of the last one
+        self.shard_offsets = torch.tensor([0, *self.shard_lengths]).cumsum(0)
+
+        # Token offset of the start of each document, and of the end of the last one
+        self.doc_offsets = map_tensor(
+            self.root / DOCUMENTS_NAME, torch.long, (manifest["num_docs"] + 1,)
+        )
+
+    @staticmethod
+    def exists(root: Path | str) -> bool:
+        """Check whether a complete export exists at `root`."""
+        return Path(root).joinpath(MANIFEST_NAME).exists()
+
+    @property
+    def num_shards(self) -> int:
+        return len(self.shard_lengths)
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_offsets) - 1
+
+    def __len__(self) -> int:
+        return int(self.shard_offsets[-1])
+
+    def shard(self, name: str, shard: int) -> EncoderOutput:
+        """Codes of every token in a shard, each of shape `(num_tokens, k)`."""
+        meta = self.hookpoints[name]
+        shape = (self.shard_lengths[shard], meta["k"])
+        path = self.root / name / f"{shard:05d}"
+
+        return EncoderOutput(
+            map_tensor(
+                path.with_suffix(".acts.bin"), str_to_dtype(meta["value_dtype"]), shape
+            ),
+            map_tensor(
+                path.with_suffix(".indices.bin"),
+                str_to_dtype(meta["index_dtype"]),
+                shape,
+            ),
+        )
+
+    def iter_shards(self, name: str) -> Iterator[EncoderOutput]:
+        """Yield the codes of each shard in order."""
+        for shard in range(self.num_shards):
+            yield self.shard(name, shard)
+
+    def tokens(self, name: str, start: int, end: int) -> EncoderOutput:
+        """Codes of the tokens with offsets in `[start, end)`."""
+        first = int(torch.searchsorted(self.shard_offsets, start, right=True)) - 1
+        last = int(torch.searchsorted(self.shard_offsets, end, right=False)) - 1
+
+        parts = [
+            self.shard(name, shard) for shard in range(first, max(last, first) + 1)
+        ]
+        lo = start - int(self.shard_offsets[first])
+        hi = end - int(self.shard_offsets[first])
+        if len(parts) == 1:
+            acts, indices = parts[0]
+            return EncoderOutput(acts[lo:hi], indices[lo:hi])
+
+        acts = torch.cat([p.top_acts for p in parts])
+        indices = torch.cat([p.top_indices for p in parts])
+        return EncoderOutput(acts[lo:hi], indices[lo:hi])
+
+    def document(self, name: str, doc: int) -> EncoderOutput:
+        """Codes of every token in a document."""
+        return self.tokens(
+            name, int(self.doc_offsets[doc]), int(self.doc_offsets[doc + 1])
+        )
@@ -1,6 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 
-from simple_parsing import Serializable, list_field
+from simple_parsing import Serializable, field, list_field
 
 
 @dataclass
@@ -28,26 +28,63 @@ class SaeConfig(Serializable):
 class TrainConfig(Serializable):
     sae: SaeConfig
 
+    sweep: list[SaeConfig] = field(default_factory=list, cmd=False)
+    """If nonempty, train an SAE with each of these configs on every hookpoint, all
+    from the same activations, instead of using `sae`."""
+
     batch_size: int = 8
     """Batch size measured in sequences."""
 
+    max_examples: int | None = None
+    """Maximum number of examples to train on. Required if the dataset has no length,
+    as is the case when streaming."""
+
+    dataloader_num_workers: int = 0
+    """Number of worker processes to use for loading data."""
+
+    prefetch_batches: int = 2
+    """Number of batches to load in the background ahead of time."""
+
     grad_acc_steps: int = 1
     """Number of steps over which to accumulate gradients."""
 
     micro_acc_steps: int = 1
     """Chunk the activations into this number of microbatches for SAE training."""
 
+    encoder_block_size: int = 0
+    """If positive, compute the encoder this many latents at a time, keeping a running
+    top-k, so that the full pre-activations are never materialized."""
+
+    b_dec_init_batches: int = 1
+    """Number of batches from which to estimate the geometric median that initializes
+    the decoder bias. Only the last of these is also used for training."""
+
+    b_dec_init_points: int = 16_384
+    """Maximum number of activations per process to sample for the geometric median."""
+
     lr: float | None = None
     """Base LR. If None, it is automatically chosen based on the number of latents."""
 
+    sweep_lr: dict[str, float] = field(default_factory=dict, cmd=False)
+    """LRs for individual sweep variants, keyed by the variant names produced by
+    `sae_variants`. These take precedence over `lr`."""
+
     lr_warmup_steps: int = 1000
 
+    lazy_adam: bool = False
+    """Use a lazy variant of Adam that only updates the encoder and decoder rows of
+    latents that received a gradient, instead of 8-bit Adam from bitsandbytes."""
+
     auxk_alpha: float = 0.0
     """Weight of the auxiliary loss term."""
 
     dead_feature_threshold: int = 10_000_000
     """Number of tokens after which a feature is considered dead."""
 
+    sync_free: bool = False
+    """Never wait on the GPU during a training step. The AuxK loss is then computed
+    even when there are no dead latents."""
+
     hookpoints: list[str] = list_field()
     """List of hookpoints to train SAEs on."""
 
@@ -57,17 +94,72 @@ class TrainConfig(Serializable):
     layer_stride: int = 1
     """Stride between layers to train SAEs on."""
 
+    stack_saes: bool = False
+    """Train SAEs of the same shape as a single stacked module, running the forward
+    and backward passes for all of them with batched ops."""
+
     distribute_modules: bool = False
     """Store a single copy of each SAE, instead of copying them across devices."""
 
+    cache_dir: str | None = None
+    """Directory in which to cache activations. If it already holds a complete cache,
+    activations are read from it instead of running the model."""
+
     save_every: int = 1000
     """Save SAEs every `save_every` steps."""
 
+    resume: bool = False
+    """Resume training from the checkpoint in `run_name`, including the optimizer
+    state and position in the dataset."""
+
+    seed: int = 42
+    """Random seed used to shuffle the dataset."""
+
     log_to_wandb: bool = True
     run_name: str | None = None
     wandb_log_frequency: int = 1
 
+    wandb_histogram_frequency: int = 100
+    """Log histograms of latent firing frequencies every `wandb_histogram_frequency`
+    steps. These are copied to the host, so they are logged much less often than the
+    other metrics, and only on steps that are logged anyway."""
+
+    debug_syncs: bool = False
+    """Count the host-device synchronizations in each training step and report them
+    in the progress bar and logs. Only detects synchronizing CUDA operations."""
+
     def __post_init__(self):
         assert not (
             self.layers and self.layer_stride != 1
         ), "Cannot specify both `layers` and `layer_stride`."
+        assert not (
+            self.stack_saes and self.encoder_block_size
+        ), "Cannot use `encoder_block_size` with `stack_saes`."
+
+        unknown = set(self.sweep_lr) - set(self.sae_variants())
+        if unknown:
+            raise ValueError(f"`sweep_lr` has LRs for unknown variants: {unknown}")
+
+    def sae_variants(self) -> dict[str, SaeConfig]:
+        """SAE configs to train on each hookpoint, keyed by a name for each variant.
+
+        Sweep variants are named after the fields that differ between them, like
+        `"expansion_factor=64,k=16"`. Without a sweep, `sae` is the only variant and
+        its name is empty.
+        """
+        if not self.sweep:
+            return {"": self.sae}
+
+        differing = [
+            f.name
+            for f in fields(SaeConfig)
+            if len({getattr(cfg, f.name) for cfg in self.sweep}) > 1
+        ]
+        names = [
+            ",".join(f"{name}={getattr(cfg, name)}" for name in differing)
+            for cfg in self.sweep
+        ]
+        if len(set(names)) != len(names):
+            raise ValueError("All configs in `sweep` must be different")
+
+        return dict(zip(names, self.sweep))
@@ -1,10 +1,15 @@
 """Tools for tokenizing and manipulating text datasets."""
 
 import math
-from multiprocessing import cpu_count
-from typing import TypeVar, Union
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+from typing import Iterable, Iterator, TypeVar, Union
 
+import torch
 from datasets import Dataset, DatasetDict
+from datasets import IterableDataset as HfIterableDataset
+from torch.utils.data import IterableDataset, get_worker_info
 from transformers import PreTrainedTokenizerBase
 
 T = TypeVar("T", bound=Union[Dataset, DatasetDict])
@@ -97,6 +102,147 @@ def chunk_and_tokenize(
     return data.with_format(format, columns=["input_ids"])
 
 
+class StreamingTokenDataset(IterableDataset):
+    """Lazily tokenize and chunk a stream of texts.
+
+    See `chunk_and_tokenize_streaming`.
+    """
+
+    def __init__(
+        self,
+        data: Iterable[dict | str],
+        tokenizer: PreTrainedTokenizerBase,
+        *,
+        num_proc: int = cpu_count() // 2,
+        text_key: str = "text",
+        max_seq_len: int = 2048,
+        batch_size: int = 2048,
+    ):
+        self.data = data
+        self.tokenizer = tokenizer
+        self.num_proc = num_proc
+        self.text_key = text_key
+        self.max_seq_len = max_seq_len
+        self.batch_size = batch_size
+
+    def __iter__(self) -> Iterator[dict[str, torch.Tensor]]:
+        chunk_size = min(self.tokenizer.model_max_length, self.max_seq_len)
+        buffer: list[int] = []
+
+        for ids in self._tokenized_batches():
+            buffer.extend(ids)
+
+            num_chunks = len(buffer) // chunk_size
+            for i in range(num_chunks):
+                chunk = buffer[i * chunk_size : (i + 1) * chunk_size]
+                yield {"input_ids": torch.tensor(chunk)}
+
+            # Carry the leftover tokens over into the next batch
+            del buffer[: num_chunks * chunk_size]
+
+    def _text_batches(self) -> Iterator[list[str]]:
+        texts = (x if isinstance(x, str) else x[self.text_key] for x in iter(self.data))
+        batches = iter(lambda: list(islice(texts, self.batch_size)), [])
+
+        # Each DataLoader worker takes every n-th batch. HuggingFace streaming
+        # datasets already split themselves between workers, so leave those alone.
+        worker = get_worker_info()
+        if worker is not None and not isinstance(self.data, HfIterableDataset):
+            batches = islice(batches, worker.id, None, worker.num_workers)
+
+        yield from batches
+
+    def _tokenized_batches(self) -> Iterator[list[int]]:
+        # DataLoader workers are daemons, and so can't start their own processes
+        if self.num_proc <= 1 or get_worker_info() is not None:
+            yield from map(self._tokenize, self._text_batches())
+            return
+
+        with Pool(
+            self.num_proc, initializer=_init_worker, initargs=(self.tokenizer,)
+        ) as pool:
+            # Keep a bounded number of batches in flight, so that we never read
+            # further ahead in the stream than the workers can keep up with
+            pending = deque()
+            for texts in self._text_batches():
+                pending.append(pool.apply_async(_tokenize_in_worker, (texts,)))
+
+                if len(pending) >= 2 * self.num_proc:
+                    yield pending.popleft().get()
+
+            while pending:
+                yield pending.popleft().get()
+
+    def _tokenize(self, texts: list[str]) -> list[int]:
+        return _tokenize_texts(self.tokenizer, texts)
+
+
+def _tokenize_texts(tokenizer: PreTrainedTokenizerBase, texts: list[str]) -> list[int]:
+    # Concatenate all the samples together, separated by the EOS token, and start
+    # with an EOS token, just like in `chunk_and_tokenize`
+    sep = tokenizer.eos_token or "<|endoftext|>"
+    output = tokenizer(
+        sep.join([""] + texts),
+        return_attention_mask=False,
+        # We do the chunking ourselves, so don't warn about long sequences
+        verbose=False,
+    )
+    return output["input_ids"]
+
+
+# Each worker process gets its own copy of the tokenizer, set by `_init_worker`
+_worker_tokenizer: PreTrainedTokenizerBase | None = None
+
+
+def _init_worker(tokenizer: PreTrainedTokenizerBase):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _tokenize_in_worker(texts: list[str]) -> list[int]:
+    assert _worker_tokenizer is not None
+    return _tokenize_texts(_worker_tokenizer, texts)
+
+
+def chunk_and_tokenize_streaming(
+    data: Iterable[dict | str],
+    tokenizer: PreTrainedTokenizerBase,
+    *,
+    num_proc: int = cpu_count() // 2,
+    text_key: str = "text",
+    max_seq_len: int = 2048,
+    batch_size: int = 2048,
+) -> StreamingTokenDataset:
+    """Streaming version of `chunk_and_tokenize` which never materializes the data.
+
+    Texts are tokenized in background worker processes as they are consumed, and
+    packed into chunks of exactly `max_seq_len` tokens on the fly. Unlike
+    `chunk_and_tokenize`, leftover tokens at the end of each batch of texts are
+    carried over into the next chunk rather than dropped; only the final partial
+    chunk is discarded.
+
+    Args:
+        data: An iterable of texts, or of dictionaries with a `text_key` entry, such
+            as a `datasets.IterableDataset`.
+        tokenizer: The tokenizer to use.
+        num_proc: The number of processes to use for tokenization.
+        text_key: The key in each example to use as the text to tokenize.
+        max_seq_len: The maximum length of a batch of input ids.
+        batch_size: The number of texts to tokenize at once in each worker.
+
+    Returns:
+        A PyTorch `IterableDataset` yielding `{"input_ids": Tensor}` examples.
+    """
+    return StreamingTokenDataset(
+        data,
+        tokenizer,
+        num_proc=num_proc,
+        text_key=text_key,
+        max_seq_len=max_seq_len,
+        batch_size=batch_size,
+    )
+
+
 def get_columns_all_equal(dataset: Union[Dataset, DatasetDict]) -> list[str]:
     """Get a single list of columns in a `Dataset` or `DatasetDict`.
 
@@ -0,0 +1,222 @@
+"""Inverted index from latents to the tokens they fire on, built over exported codes.
+
+The index has one segment per shard of a `SparseCodes` export. Each segment stores,
+for every hookpoint, the tokens on which each latent fired sorted by descending
+activation, in compressed sparse row (CSR) form:
+
+- `{hookpoint}/{shard}.offsets.bin`: where each latent's postings start, plus the end
+- `{hookpoint}/{shard}.tokens.bin`: token offsets relative to the start of the shard
+- `{hookpoint}/{shard}.acts.bin`: the matching activations
+
+Segments are memory-mapped, so a query only reads the first few postings of each
+latent it asks about, from every segment.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Sequence
+
+import torch
+from torch import Tensor
+
+from .codes import SparseCodes
+from .utils import map_tensor, str_to_dtype, write_tensor
+
+INDEX_NAME = "index.json"
+
+
+def build_postings(
+    top_acts: Tensor, top_indices: Tensor, num_latents: int
+) -> tuple[Tensor, Tensor, Tensor]:
+    """Turn `(num_tokens, k)` codes into per-latent postings sorted by activation.
+
+    Returns the CSR offsets of each latent, of shape `(num_latents + 1,)`, and the
+    tokens and activations of the postings. Only positive activations are kept.
+    """
+    k = top_acts.shape[-1]
+    acts = top_acts.flatten()
+    fired = acts > 0
+
+    acts = acts[fired]
+    latents = top_indices.flatten()[fired].long()
+    tokens = torch.arange(len(top_acts), dtype=torch.int32).repeat_interleave(k)
+    tokens = tokens[fired]
+
+    # Sort by latent, then by descending activation, with a single sort. The bits of
+    # a positive float32 compare in the same order as the floats themselves.
+    bits = acts.float().view(torch.int32).long()
+    order = (latents << 31 | (2**31 - 1 - bits)).argsort()
+
+    counts = torch.bincount(latents, minlength=num_latents)
+    offsets = torch.cat([counts.new_zeros(1), counts.cumsum(0)])
+    return offsets, tokens[order], acts[order]
+
+
+def build_index(codes_root: Path | str, root: Path | str) -> int:
+    """Index the shards of the codes at `codes_root` that aren't indexed yet.
+
+    Returns the number of new segments. Rerun this after appending to the codes to
+    bring the index up to date. The manifest is rewritten after each segment, so an
+    interrupted build loses at most the segment that was in progress. If the codes
+    no longer match the segments already indexed, for example because they were
+    exported again, the index is rebuilt from the first segment that differs. Shards
+    are matched by the id `CodeWriter` gives them, so this also catches codes that
+    were exported again with the same shard sizes.
+    """
+    codes = SparseCodes(codes_root)
+    root = Path(root)
+
+    if root.joinpath(INDEX_NAME).exists():
+        with open(root / INDEX_NAME) as f:
+            manifest = json.load(f)
+    else:
+        manifest = {"hookpoints": {}, "segments": []}
+
+    def segment(shard: int) -> dict:
+        return {
+            "token_offset": int(codes.shard_offsets[shard]),
+            "num_tokens": codes.shard_lengths[shard],
+            "shard_id": codes.shard_ids[shard],
+        }
+
+    # Keep the segments that were built from the same shards as the codes have now
+    start = 0
+    for existing in manifest["segments"][: codes.num_shards]:
+        if existing != segment(start):
+            break
+        start += 1
+
+    if start < len(manifest["segments"]):
+        del manifest["segments"][start:]
+        if start == 0:
+            manifest["hookpoints"] = {}
+
+        write_manifest(root, manifest)
+
+    for name, meta in codes.hookpoints.items():
+        manifest["hookpoints"].setdefault(
+            name,
+            {"num_latents": meta["num_latents"], "value_dtype": meta["value_dtype"]},
+        )
+    for shard in range(start, codes.num_shards):
+        # Tokens are stored relative to the start of the shard
+        assert codes.shard_lengths[shard] < 2**31, "Shard is too large to index"
+
+        for name, meta in manifest["hookpoints"].items():
+            offsets, tokens, acts = build_postings(
+                *codes.shard(name, shard), meta["num_latents"]
+            )
+            path = root / name / f"{shard:05d}"
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            for suffix, x in [
+                (".offsets.bin", offsets),
+                (".tokens.bin", tokens),
+                (".acts.bin", acts),
+            ]:
+                with open(path.with_suffix(suffix), "wb") as f:
+                    write_tensor(f, x)
+
+        manifest["segments"].append(segment(shard))
+
+        write_manifest(root, manifest)
+
+    return codes.num_shards - start
+
+
+def write_manifest(root: Path, manifest: dict):
+    """Replace the manifest atomically, so it never refers to a missing segment."""
+    root.mkdir(parents=True, exist_ok=True)
+
+    tmp = root / f"{INDEX_NAME}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, root / INDEX_NAME)
+
+
+class LatentIndex:
+    """Query an index written by `build_index`.
+
+    Tokens are identified by their offset in the stream of codes, which can be looked
+    up in `SparseCodes.doc_offsets` to find the document they belong to.
+    """
+
+    def __init__(self, root: Path | str):
+        self.root = Path(root)
+
+        with open(self.root / INDEX_NAME) as f:
+            manifest = json.load(f)
+
+        self.hookpoints: dict[str, dict] = manifest["hookpoints"]
+        self.segments: list[dict] = manifest["segments"]
+
+        # Postings of each hookpoint, one (offsets, tokens, acts) triple per segment
+        self.postings: dict[str, list[tuple[Tensor, Tensor, Tensor]]] = {
+            name: [self._map_segment(name, i) for i in range(len(self.segments))]
+            for name in self.hookpoints
+        }
+
+    def _map_segment(self, name: str, segment: int) -> tuple[Tensor, Tensor, Tensor]:
+        meta = self.hookpoints[name]
+        path = self.root / name / f"{segment:05d}"
+
+        offsets = map_tensor(
+            path.with_suffix(".offsets.bin"), torch.long, (meta["num_latents"] + 1,)
+        )
+        num_postings = int(offsets[-1])
+        tokens = map_tensor(
+            path.with_suffix(".tokens.bin"), torch.int32, (num_postings,)
+        )
+        acts = map_tensor(
+            path.with_suffix(".acts.bin"),
+            str_to_dtype(meta["value_dtype"]),
+            (num_postings,),
+        )
+        return offsets, tokens, acts
+
+    def num_postings(self, name: str) -> Tensor:
+        """Number of tokens on which each latent of a hookpoint fired."""
+        return sum(offsets.diff() for offsets, _, _ in self.postings[name])
+
+    def top(
+        self, name: str, latents: int | Sequence[int] | Tensor, m: int = 10
+    ) -> tuple[Tensor, Tensor]:
+        """Top `m` activations of one latent or of each of several latents.
+
+        Returns the activations in descending order and the offsets of the tokens
+        they occurred on. For a single latent both have shape `(m,)`, and for several
+        they have shape `(len(latents), m)`. Latents that fired on fewer than `m`
+        tokens are padded with activations of `-inf` and tokens of -1.
+        """
+        single = isinstance(latents, int)
+        latents = torch.as_tensor(latents, dtype=torch.long).view(-1)
+        ranks = torch.arange(m)
+
+        # Start with padding, so that we always have at least `m` candidates
+        all_acts = [torch.full((len(latents), m), -torch.inf)]
+        all_tokens = [torch.full((len(latents), m), -1)]
+
+        for segment, (offsets, tokens, acts) in zip(self.segments, self.postings[name]):
+            if not len(tokens):
+                continue
+
+            # Each latent's postings are sorted, so we only need the first `m`
+            starts, ends = offsets[latents], offsets[latents + 1]
+            idx = starts[:, None] + ranks
+            valid = idx < ends[:, None]
+            idx = idx.where(valid, 0)
+
+            all_acts.append(acts[idx].float().where(valid, -torch.inf))
+            all_tokens.append(
+                (tokens[idx].long() + segment["token_offset"]).where(valid, -1)
+            )
+
+        # Merge the candidates from every segment
+        top_acts, idx = torch.cat(all_acts, dim=1).topk(m, dim=1)
+        top_tokens = torch.cat(all_tokens, dim=1).gather(1, idx)
+
+        if single:
+            return top_acts[0], top_tokens[0]
+
+        return top_acts, top_tokens
@@ -0,0 +1,72 @@
+from typing import Callable, Iterable
+
+import torch
+from torch import Tensor
+from torch.optim import Optimizer
+
+
+class LazyAdam(Optimizer):
+    """Adam that only updates the rows of each parameter with a nonzero gradient.
+
+    With TopK SAEs, only the latents that fire on a batch receive gradients, so most
+    rows of the encoder and decoder are untouched on any given step. Rows are indexed
+    along the first dimension, and each row keeps its own step count so that bias
+    correction accounts for the steps it skipped. As in TensorFlow's `LazyAdam`, the
+    moments of skipped rows are left as they are rather than decayed, so this is not
+    exactly equivalent to dense Adam.
+    """
+
+    def __init__(
+        self,
+        params: Iterable[Tensor] | Iterable[dict],
+        lr: float = 1e-3,
+        betas: tuple[float, float] = (0.9, 0.999),
+        eps: float = 1e-8,
+    ):
+        super().__init__(params, dict(lr=lr, betas=betas, eps=eps))
+
+    @torch.no_grad()
+    def step(self, closure: Callable[[], float] | None = None) -> float | None:
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group["betas"]
+
+            for p in group["params"]:
+                if p.grad is None:
+                    continue
+
+                state = self.state[p]
+                if not state:
+                    state["step"] = torch.zeros(
+                        len(p) if p.ndim else 1, device=p.device
+                    )
+                    state["exp_avg"] = torch.zeros_like(p)
+                    state["exp_avg_sq"] = torch.zeros_like(p)
+
+                # View everything as (rows, everything else)
+                param, grad, exp_avg, exp_avg_sq = (
+                    x.view(len(state["step"]), -1)
+                    for x in (p, p.grad, state["exp_avg"], state["exp_avg_sq"])
+                )
+                rows = grad.ne(0).any(dim=-1).nonzero().squeeze(-1)
+                grad = grad[rows]
+
+                steps = state["step"].index_add_(
+                    0, rows, torch.ones_like(rows, dtype=state["step"].dtype)
+                )[rows, None]
+
+                m = exp_avg[rows].lerp_(grad, 1 - beta1)
+                v = exp_avg_sq[rows].mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                exp_avg.index_copy_(0, rows, m)
+                exp_avg_sq.index_copy_(0, rows, v)
+
+                # Bias correction with each row's own step count
+                m /= 1 - beta1**steps
+                denom = v.div_(1 - beta2**steps).sqrt_().add_(group["eps"])
+                param.index_add_(0, rows, m / denom, alpha=-group["lr"])
+
+        return loss
@@ -1,4 +1,5 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 from fnmatch import fnmatch
 from pathlib import Path
 from typing import NamedTuple
@@ -7,11 +8,11 @@ import einops
 import torch
 from huggingface_hub import snapshot_download
 from natsort import natsorted
-from safetensors.torch import load_model, save_model
+from safetensors.torch import save_model
 from torch import Tensor, nn
 
 from .config import SaeConfig
-from .utils import decoder_impl
+from .utils import GatheredLinear, blocked_topk, decoder_impl, load_safetensors
 
 
 class EncoderOutput(NamedTuple):
@@ -57,7 +58,10 @@ class Sae(nn.Module):
         self.encoder.bias.data.zero_()
 
         self.W_dec = nn.Parameter(self.encoder.weight.data.clone()) if decoder else None
-        if decoder and self.cfg.normalize_decoder:
+
+        # Meta tensors have no values to normalize. They're used when loading weights.
+        meta = torch.device(device).type == "meta"
+        if decoder and self.cfg.normalize_decoder and not meta:
             self.set_decoder_norm_to_unit_norm()
 
         self.b_dec = nn.Parameter(torch.zeros(d_in, dtype=dtype, device=device))
@@ -69,20 +73,72 @@ class Sae(nn.Module):
         *,
         decoder: bool = True,
         pattern: str | None = None,
+        hookpoints: list[str] | None = None,
+        dtype: torch.dtype | None = None,
+        mmap: bool = False,
+        max_workers: int | None = None,
     ) -> dict[str, "Sae"]:
-        """Load SAEs for multiple hookpoints on a single model and dataset."""
-        pattern = pattern + "/*" if pattern is not None else None
-        repo_path = Path(snapshot_download(name, allow_patterns=pattern))
-
-        files = [
-            f
-            for f in repo_path.iterdir()
-            if f.is_dir() and (pattern is None or fnmatch(f.name, pattern))
-        ]
-        return {
-            f.stem: Sae.load_from_disk(f, device=device, decoder=decoder)
-            for f in natsorted(files, key=lambda f: f.stem)
-        }
+        """Load SAEs for multiple hookpoints on a single model and dataset.
+
+        Only the hookpoints matching `pattern`, and in `hookpoints` if it is given, are
+        downloaded and loaded. See `load_many_from_disk` for the other arguments.
+        """
+        if hookpoints is not None:
+            allow_patterns = [f"{hookpoint}/*" for hookpoint in hookpoints]
+        else:
+            allow_patterns = pattern + "/*" if pattern is not None else None
+
+        repo_path = Path(snapshot_download(name, allow_patterns=allow_patterns))
+        return Sae.load_many_from_disk(
+            repo_path,
+            device=device,
+            decoder=decoder,
+            pattern=pattern,
+            hookpoints=hookpoints,
+            dtype=dtype,
+            mmap=mmap,
+            max_workers=max_workers,
+        )
+
+    @staticmethod
+    def load_many_from_disk(
+        path: Path | str,
+        device: str | torch.device = "cpu",
+        *,
+        decoder: bool = True,
+        pattern: str | None = None,
+        hookpoints: list[str] | None = None,
+        dtype: torch.dtype | None = None,
+        mmap: bool = False,
+        max_workers: int | None = None,
+    ) -> dict[str, "Sae"]:
+        """Load the SAEs stored in the subdirectories of `path`, one per hookpoint.
+
+        Hookpoints are loaded concurrently by a pool of up to `max_workers` threads.
+        If `decoder` is False, the decoder weights are never read from disk.
+        """
+        path = Path(path)
+        if hookpoints is not None:
+            files = [path / hookpoint for hookpoint in hookpoints]
+            missing = [f.name for f in files if not f.is_dir()]
+            if missing:
+                raise FileNotFoundError(f"No SAEs found for hookpoints {missing}")
+        else:
+            # Skip anything that isn't an SAE, like the trainer's state
+            files = [f for f in path.iterdir() if (f / "cfg.json").exists()]
+
+        files = natsorted(
+            [f for f in files if pattern is None or fnmatch(f.name, pattern)],
+            key=lambda f: f.name,
+        )
+        with ThreadPoolExecutor(max_workers) as pool:
+            saes = pool.map(
+                lambda f: Sae.load_from_disk(
+                    f, device=device, decoder=decoder, dtype=dtype, mmap=mmap
+                ),
+                files,
+            )
+            return {f.name: sae for f, sae in zip(files, saes)}
 
     @staticmethod
     def load_from_hub(
@@ -91,6 +147,8 @@ class Sae(nn.Module):
         device: str | torch.device = "cpu",
         *,
         decoder: bool = True,
+        dtype: torch.dtype | None = None,
+        mmap: bool = False,
     ) -> "Sae":
         # Download from the HuggingFace Hub
         repo_path = Path(
@@ -106,7 +164,9 @@ class Sae(nn.Module):
         elif not repo_path.joinpath("cfg.json").exists():
             raise FileNotFoundError("No config file found; try specifying a layer.")
 
-        return Sae.load_from_disk(repo_path, device=device, decoder=decoder)
+        return Sae.load_from_disk(
+            repo_path, device=device, decoder=decoder, dtype=dtype, mmap=mmap
+        )
 
     @staticmethod
     def load_from_disk(
@@ -114,7 +174,17 @@ class Sae(nn.Module):
         device: str | torch.device = "cpu",
         *,
         decoder: bool = True,
+        dtype: torch.dtype | None = None,
+        mmap: bool = False,
     ) -> "Sae":
+        """Load an SAE saved with `save_to_disk`.
+
+        The module is constructed on the meta device, so no time is spent on random
+        initialization, and the tensors from `sae.safetensors` are then assigned to
+        it directly. If `mmap` is set (and the file already has the right dtype),
+        CPU weights are memory-mapped from disk instead of being copied into memory.
+        Weights are cast to `dtype`, or to PyTorch's default dtype if it is `None`.
+        """
         path = Path(path)
 
         with open(path / "cfg.json", "r") as f:
@@ -122,13 +192,19 @@ class Sae(nn.Module):
             d_in = cfg_dict.pop("d_in")
             cfg = SaeConfig(**cfg_dict)
 
-        sae = Sae(d_in, cfg, device=device, decoder=decoder)
-        load_model(
-            model=sae,
-            filename=str(path / "sae.safetensors"),
-            device=str(device),
-            # TODO: Maybe be more fine-grained about this in the future?
-            strict=decoder,
+        # Nothing is initialized on the meta device, since we overwrite it anyway
+        sae = Sae(d_in, cfg, device="meta", decoder=decoder)
+
+        # Only read the tensors we actually need, e.g. skipping the decoder
+        state_dict = load_safetensors(
+            path / "sae.safetensors",
+            device=device,
+            keys=sae.state_dict().keys(),
+            mmap=mmap,
+        )
+        dtype = dtype or torch.get_default_dtype()
+        sae.load_state_dict(
+            {k: v.to(device, dtype) for k, v in state_dict.items()}, assign=True
         )
         return sae
 
@@ -171,9 +247,62 @@ class Sae(nn.Module):
 
         return EncoderOutput(*latents.topk(self.cfg.k, sorted=False))
 
-    def encode(self, x: Tensor) -> EncoderOutput:
-        """Encode the input and select the top-k latents."""
-        return self.select_topk(self.pre_acts(x))
+    def encode(self, x: Tensor, *, block_size: int | None = None) -> EncoderOutput:
+        """Encode the input and select the top-k latents.
+
+        If `block_size` is given, the latents are computed that many at a time, so
+        the full `(N, num_latents)` pre-activations are never materialized.
+        """
+        if block_size is None:
+            return self.select_topk(self.pre_acts(x))
+
+        top, _ = self.blocked_encode(x.flatten(0, -2), block_size)
+        return EncoderOutput(
+            top.top_acts.view(*x.shape[:-1], -1),
+            top.top_indices.view(*x.shape[:-1], -1),
+        )
+
+    def blocked_encode(
+        self,
+        x: Tensor,
+        block_size: int,
+        *,
+        dead_mask: Tensor | None = None,
+        k_aux: int = 0,
+    ) -> tuple[EncoderOutput, EncoderOutput | None]:
+        """Encode `x` of shape `(N, d_in)` one block of latents at a time.
+
+        If `k_aux` is positive, also select the top `k_aux` latents among those in
+        `dead_mask`, for the AuxK loss, in the same pass. Gradients only flow through
+        the selected latents, which is all that the non-blocked path uses anyway.
+        """
+        sae_in = x.to(self.dtype) - self.b_dec
+        (values, indices), aux = blocked_topk(
+            sae_in.detach(),
+            self.encoder.weight.detach(),
+            self.encoder.bias.detach(),
+            self.cfg.k,
+            block_size,
+            signed=self.cfg.signed,
+            aux_k=k_aux,
+            aux_mask=dead_mask,
+        )
+        if aux is not None:
+            values = torch.cat([values, aux[0]], dim=-1)
+            indices = torch.cat([indices, aux[1]], dim=-1)
+
+        # Recompute the selected pre-activations in a differentiable way
+        acts = GatheredLinear.apply(
+            sae_in, self.encoder.weight, self.encoder.bias, indices, values
+        )
+        if not self.cfg.signed:
+            acts = nn.functional.relu(acts)
+
+        top = EncoderOutput(acts[:, : self.cfg.k], indices[:, : self.cfg.k])
+        if aux is None:
+            return top, None
+
+        return top, EncoderOutput(acts[:, self.cfg.k :], indices[:, self.cfg.k :])
 
     def decode(self, top_acts: Tensor, top_indices: Tensor) -> Tensor:
         assert self.W_dec is not None, "Decoder weight was not initialized."
@@ -181,9 +310,40 @@ class Sae(nn.Module):
         y = decoder_impl(top_indices, top_acts.to(self.dtype), self.W_dec.mT)
         return y + self.b_dec
 
-    def forward(self, x: Tensor, dead_mask: Tensor | None = None) -> ForwardOutput:
-        pre_acts = self.pre_acts(x)
-        top_acts, top_indices = self.select_topk(pre_acts)
+    def forward(
+        self,
+        x: Tensor,
+        dead_mask: Tensor | None = None,
+        *,
+        block_size: int | None = None,
+        sync_free: bool = False,
+    ) -> ForwardOutput:
+        """Encode and decode `x`, computing the AuxK loss if `dead_mask` is given.
+
+        By default, we read the number of dead latents back to the host in order to
+        skip the AuxK loss when there are none. If `sync_free` is set, the count stays
+        on the device and the AuxK loss is always computed, so that the forward pass
+        never waits on the GPU.
+        """
+        # Heuristic from Appendix B.1 in the paper
+        k_aux = x.shape[-1] // 2
+        if dead_mask is None:
+            num_dead = 0
+        elif sync_free:
+            num_dead = dead_mask.sum()
+        else:
+            num_dead = int(dead_mask.sum())
+
+        if block_size is None:
+            pre_acts = self.pre_acts(x)
+            top_acts, top_indices = self.select_topk(pre_acts)
+        else:
+            (top_acts, top_indices), auxk = self.blocked_encode(
+                x,
+                block_size,
+                dead_mask=dead_mask,
+                k_aux=k_aux if sync_free else min(k_aux, num_dead),
+            )
 
         # Decode and compute residual
         sae_out = self.decode(top_acts, top_indices)
@@ -193,19 +353,28 @@ class Sae(nn.Module):
         total_variance = (x - x.mean(0)).pow(2).sum(0)
 
         # Second decoder pass for AuxK loss
-        if dead_mask is not None and (num_dead := int(dead_mask.sum())) > 0:
-            # Heuristic from Appendix B.1 in the paper
-            k_aux = x.shape[-1] // 2
-
+        if dead_mask is not None and (sync_free or num_dead > 0):
             # Reduce the scale of the loss if there are a small number of dead latents
-            scale = min(num_dead / k_aux, 1.0)
-            k_aux = min(k_aux, num_dead)
-
-            # Don't include living latents in this loss
-            auxk_latents = torch.where(dead_mask[None], pre_acts, -torch.inf)
-
-            # Top-k dead latents
-            auxk_acts, auxk_indices = auxk_latents.topk(k_aux, sorted=False)
+            if isinstance(num_dead, Tensor):
+                scale = (num_dead / k_aux).clamp(max=1.0)
+            else:
+                scale = min(num_dead / k_aux, 1.0)
+                k_aux = min(k_aux, num_dead)
+
+            if block_size is None:
+                # Don't include living latents in this loss
+                auxk_latents = torch.where(dead_mask[None], pre_acts, -torch.inf)
+
+                # Top-k dead latents
+                auxk_acts, auxk_indices = auxk_latents.topk(k_aux, sorted=False)
+            else:
+                assert auxk is not None
+                auxk_acts, auxk_indices = auxk
+
+            # If fewer than k_aux latents are dead, we selected some living ones too.
+            # Zero them out rather than shrinking k_aux, which would need a sync.
+            if sync_free:
+                auxk_acts = torch.where(dead_mask[auxk_indices], auxk_acts, 0)
 
             # Encourage the top ~50% of dead latents to predict the residual of the
             # top k living latents
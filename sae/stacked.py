@@ -0,0 +1,303 @@
+from typing import Sequence
+
+import torch
+from natsort import natsorted
+from torch import Tensor, nn
+
+from .config import SaeConfig
+from .sae import EncoderOutput, ForwardOutput, Sae
+from .utils import decoder_impl
+
+
+def stack_key(sae: Sae) -> tuple:
+    """SAEs can be stacked together if and only if their keys are equal.
+
+    A stack uses the config of its first SAE, so this includes every config field
+    that `StackedSae` reads.
+    """
+    return (
+        sae.d_in,
+        sae.num_latents,
+        sae.cfg.k,
+        sae.cfg.signed,
+        sae.cfg.normalize_decoder,
+        sae.device,
+        sae.dtype,
+        sae.W_dec is not None,
+    )
+
+
+class StackedSae(nn.Module):
+    """Several SAEs of the same shape, stored as parameters with a leading SAE dim.
+
+    Inputs and outputs also carry the leading SAE dimension, so every SAE in the
+    stack is encoded with a single batched matmul and a single top-k.
+    """
+
+    def __init__(
+        self,
+        num_saes: int,
+        d_in: int,
+        cfg: SaeConfig,
+        device: str | torch.device = "cpu",
+        dtype: torch.dtype | None = None,
+        *,
+        decoder: bool = True,
+    ):
+        super().__init__()
+        self.cfg = cfg
+        self.d_in = d_in
+        self.num_saes = num_saes
+        self.num_latents = cfg.num_latents or d_in * cfg.expansion_factor
+
+        # Same distribution as the default initialization of `nn.Linear`
+        shape = (num_saes, self.num_latents, d_in)
+        bound = d_in**-0.5
+        self.W_enc = nn.Parameter(
+            torch.empty(shape, device=device, dtype=dtype).uniform_(-bound, bound)
+        )
+        self.b_enc = nn.Parameter(torch.zeros(shape[:-1], device=device, dtype=dtype))
+
+        self.W_dec = nn.Parameter(self.W_enc.data.clone()) if decoder else None
+        if decoder and self.cfg.normalize_decoder:
+            self.set_decoder_norm_to_unit_norm()
+
+        self.b_dec = nn.Parameter(
+            torch.zeros(num_saes, d_in, device=device, dtype=dtype)
+        )
+
+    @staticmethod
+    def from_saes(saes: Sequence[Sae]) -> "StackedSae":
+        """Stack the weights of `saes`, which must all have the same shape and config.
+
+        The input SAEs are then tied to the stack: their parameters become views into
+        the stacked parameters, so no memory is duplicated and updating one updates
+        the other.
+        """
+        first = saes[0]
+        for sae in saes:
+            if stack_key(sae) != stack_key(first):
+                raise ValueError("All SAEs in a stack must have the same shape")
+
+        stack = StackedSae(
+            len(saes),
+            first.d_in,
+            first.cfg,
+            device=first.device,
+            dtype=first.dtype,
+            decoder=first.W_dec is not None,
+        )
+        with torch.no_grad():
+            for i, sae in enumerate(saes):
+                stack.W_enc[i] = sae.encoder.weight
+                stack.b_enc[i] = sae.encoder.bias
+                stack.b_dec[i] = sae.b_dec
+                if stack.W_dec is not None:
+                    stack.W_dec[i] = sae.W_dec
+
+        stack.tie(saes)
+        return stack
+
+    def tie(self, saes: Sequence[Sae]):
+        """Make the parameters (and gradients) of `saes` views into this stack."""
+        assert len(saes) == self.num_saes
+
+        for i, sae in enumerate(saes):
+            pairs = [
+                (sae.encoder.weight, self.W_enc),
+                (sae.encoder.bias, self.b_enc),
+                (sae.b_dec, self.b_dec),
+            ]
+            if sae.W_dec is not None and self.W_dec is not None:
+                pairs.append((sae.W_dec, self.W_dec))
+
+            for param, stacked in pairs:
+                param.data = stacked.data[i]
+                if stacked.grad is not None:
+                    param.grad = stacked.grad[i]
+
+    def init_grads(self, saes: Sequence[Sae]):
+        """Allocate zeroed gradients for the stack, and make those of `saes` views.
+
+        Autograd then accumulates each SAE's gradients straight into the stacked
+        buffers, as long as they are zeroed in place instead of set to `None`.
+        """
+        for param in self.parameters():
+            param.grad = torch.zeros_like(param)
+
+        self.tie(saes)
+
+    @property
+    def device(self):
+        return self.W_enc.device
+
+    @property
+    def dtype(self):
+        return self.W_enc.dtype
+
+    def pre_acts(self, x: Tensor) -> Tensor:
+        """Encoder outputs for `x` of shape `(num_saes, N, d_in)`."""
+        sae_in = x.to(self.dtype) - self.b_dec[:, None]
+        out = torch.baddbmm(self.b_enc[:, None], sae_in, self.W_enc.mT)
+
+        return nn.functional.relu(out) if not self.cfg.signed else out
+
+    def select_topk(self, latents: Tensor) -> EncoderOutput:
+        """Select the top-k latents."""
+        if self.cfg.signed:
+            _, top_indices = latents.abs().topk(self.cfg.k, sorted=False)
+            top_acts = latents.gather(dim=-1, index=top_indices)
+
+            return EncoderOutput(top_acts, top_indices)
+
+        return EncoderOutput(*latents.topk(self.cfg.k, sorted=False))
+
+    def encode(self, x: Tensor) -> EncoderOutput:
+        """Encode the input and select the top-k latents."""
+        return self.select_topk(self.pre_acts(x))
+
+    def decode(self, top_acts: Tensor, top_indices: Tensor) -> Tensor:
+        assert self.W_dec is not None, "Decoder weight was not initialized."
+
+        # Offset the indices of each SAE so that we can decode with one flat matrix
+        offsets = torch.arange(self.num_saes, device=top_indices.device)
+        flat_indices = top_indices + offsets[:, None, None] * self.num_latents
+        W_dec = self.W_dec.flatten(0, 1)
+
+        y = decoder_impl(
+            flat_indices.flatten(0, 1),
+            top_acts.to(self.dtype).flatten(0, 1),
+            W_dec.mT,
+        )
+        return y.view(self.num_saes, -1, self.d_in) + self.b_dec[:, None]
+
+    def forward(self, x: Tensor, dead_mask: Tensor | None = None) -> ForwardOutput:
+        """Like `Sae.forward`, for `x` of shape `(num_saes, N, d_in)`.
+
+        The losses in the output have shape `(num_saes,)`. `dead_mask` should have
+        shape `(num_saes, num_latents)`. Since the number of dead latents differs
+        between SAEs, the AuxK loss always selects the same number of latents and
+        zeroes out the living ones.
+        """
+        pre_acts = self.pre_acts(x)
+        top_acts, top_indices = self.select_topk(pre_acts)
+
+        # Decode and compute residual
+        sae_out = self.decode(top_acts, top_indices)
+        e = sae_out - x
+
+        # Used as a denominator for putting everything on a reasonable scale
+        total_variance = (x - x.mean(1, keepdim=True)).pow(2).sum(1)
+
+        # Second decoder pass for AuxK loss
+        if dead_mask is not None:
+            # Heuristic from Appendix B.1 in the paper
+            k_aux = x.shape[-1] // 2
+
+            # Reduce the scale of the loss if there are a small number of dead latents
+            scale = (dead_mask.sum(-1) / k_aux).clamp(max=1.0)
+
+            # Top-k dead latents, zeroing out any living ones we had to select
+            auxk_latents = torch.where(dead_mask[:, None], pre_acts, -torch.inf)
+            auxk_acts, auxk_indices = auxk_latents.topk(k_aux, sorted=False)
+            is_dead = dead_mask.gather(-1, auxk_indices.flatten(1))
+            auxk_acts = torch.where(is_dead.view_as(auxk_acts), auxk_acts, 0)
+
+            # Encourage the top ~50% of dead latents to predict the residual of the
+            # top k living latents
+            e_hat = self.decode(auxk_acts, auxk_indices)
+            auxk_loss = (e_hat - e).pow(2).sum(1)
+            auxk_loss = scale * torch.mean(auxk_loss / total_variance, dim=-1)
+        else:
+            auxk_loss = sae_out.new_zeros(self.num_saes)
+
+        l2_loss = e.pow(2).sum(1)
+        fvu = torch.mean(l2_loss / total_variance, dim=-1)
+
+        return ForwardOutput(sae_out, top_acts, top_indices, fvu, auxk_loss)
+
+    @torch.no_grad()
+    def set_decoder_norm_to_unit_norm(self):
+        assert self.W_dec is not None, "Decoder weight was not initialized."
+
+        eps = torch.finfo(self.W_dec.dtype).eps
+        norm = torch.norm(self.W_dec.data, dim=-1, keepdim=True)
+        self.W_dec.data /= norm + eps
+
+    @torch.no_grad()
+    def remove_gradient_parallel_to_decoder_directions(self):
+        assert self.W_dec is not None, "Decoder weight was not initialized."
+        assert self.W_dec.grad is not None  # keep pyright happy
+
+        parallel_component = (self.W_dec.grad * self.W_dec.data).sum(-1, keepdim=True)
+        self.W_dec.grad -= parallel_component * self.W_dec.data
+
+    @torch.no_grad()
+    def clip_grad_norm_(self, max_norm: float) -> Tensor:
+        """Clip the gradient norm of each SAE in the stack independently.
+
+        Equivalent to calling `torch.nn.utils.clip_grad_norm_` on the parameters of
+        each SAE, but batched. Returns the norm of each SAE's gradients before clipping.
+        """
+        grads = [p.grad for p in self.parameters() if p.grad is not None]
+        norms = torch.stack([g.flatten(1).norm(dim=1) for g in grads]).norm(dim=0)
+
+        coefs = (max_norm / (norms + 1e-6)).clamp(max=1.0)
+        for grad in grads:
+            grad *= coefs.view(-1, *[1] * (grad.ndim - 1)).to(grad.dtype)
+
+        return norms
+
+
+class SaeGroup:
+    """Run many SAEs at once, e.g. ones returned by `Sae.load_many_from_hub`.
+
+    SAEs with the same input width and config are stacked into a `StackedSae`, so
+    they are encoded and decoded with batched ops. SAEs with different shapes end up
+    in separate stacks.
+    """
+
+    def __init__(self, saes: dict[str, Sae]):
+        groups: dict[tuple, list[str]] = {}
+        for name in natsorted(saes):
+            groups.setdefault(stack_key(saes[name]), []).append(name)
+
+        self.hookpoints = natsorted(saes)
+        self.groups: list[tuple[list[str], StackedSae]] = [
+            (names, StackedSae.from_saes([saes[name] for name in names]))
+            for names in groups.values()
+        ]
+
+    def encode(self, hiddens: dict[str, Tensor]) -> dict[str, EncoderOutput]:
+        """Encode the activations at each hookpoint.
+
+        Every tensor in `hiddens` must have the same leading dimensions, and there
+        must be one for each hookpoint in the group.
+        """
+        outputs = {}
+        for names, stack in self.groups:
+            x = torch.stack([hiddens[name] for name in names])
+            top_acts, top_indices = stack.encode(x.flatten(1, -2))
+
+            for name, acts, indices in zip(names, top_acts, top_indices):
+                outputs[name] = EncoderOutput(
+                    acts.view(*x.shape[1:-1], -1), indices.view(*x.shape[1:-1], -1)
+                )
+
+        return {name: outputs[name] for name in self.hookpoints}
+
+    def decode(self, codes: dict[str, EncoderOutput]) -> dict[str, Tensor]:
+        """Decode the latents for each hookpoint."""
+        outputs = {}
+        for names, stack in self.groups:
+            top_acts = torch.stack([codes[name].top_acts for name in names])
+            top_indices = torch.stack([codes[name].top_indices for name in names])
+            y = stack.decode(top_acts.flatten(1, -2), top_indices.flatten(1, -2))
+
+            for name, out in zip(names, y):
+                outputs[name] = out.view(*top_acts.shape[1:-1], -1)
+
+        return {name: outputs[name] for name in self.hookpoints}
+
+    def __len__(self) -> int:
+        return len(self.hookpoints)
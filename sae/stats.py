@@ -0,0 +1,390 @@
+"""Collect per-latent activation statistics by streaming a dataset through a model.
+
+Run with `python -m sae.stats --help` to see the available options. The statistics of
+each hookpoint are written to `{output}/{hookpoint}/stats.safetensors`, along with a
+`stats.json` file describing the run and the histogram bins.
+"""
+
+import json
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+import torch
+from safetensors.torch import save_file
+from simple_parsing import Serializable, field, list_field, parse
+from torch import Tensor
+from tqdm.auto import tqdm
+from transformers import PreTrainedModel
+
+from .codes import CodeWriter, iter_codes
+from .sae import Sae
+from .utils import load_safetensors, prefetch, str_to_dtype
+
+STATS_NAME = "stats.json"
+
+
+@dataclass
+class StatsConfig(Serializable):
+    model: str = field(positional=True)
+    """Name of the model to run."""
+
+    saes: str = field(positional=True)
+    """Name of the SAEs on the HuggingFace Hub, or the directory they were saved to."""
+
+    dataset: str = field(positional=True)
+    """Path to the dataset to stream through the model."""
+
+    split: str = "train"
+    """Dataset split to use."""
+
+    ctx_len: int = 2048
+    """Context length to use, if the dataset isn't already tokenized."""
+
+    hookpoints: list[str] = list_field()
+    """Hookpoints to collect statistics for. If empty, use every available SAE."""
+
+    batch_size: int = 8
+    """Number of sequences to run through the model at once."""
+
+    max_examples: int | None = None
+    """Maximum number of sequences to use. If `None`, use the whole dataset."""
+
+    top_n: int = 16
+    """Number of top activating tokens to keep for each latent."""
+
+    num_bins: int = 64
+    """Number of bins in each latent's histogram of activations."""
+
+    hist_min: float = 1e-3
+    """Lower edge of the histogram. Smaller activations are counted in the first bin."""
+
+    hist_max: float = 1e3
+    """Upper edge of the histogram. Larger activations are counted in the last bin."""
+
+    output: str = "stats"
+    """Directory to write the statistics to."""
+
+    codes_dir: str | None = None
+    """If set, also export the sparse codes of every token to this directory."""
+
+    codes_dtype: str | None = None
+    """Dtype to store exported activations in, like `float16`. Defaults to the SAE's."""
+
+    device: str = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class LatentStats:
+    """Running statistics of the activations of every latent of one SAE.
+
+    Only positive activations count as firing. Memory use is fixed up front: a few
+    scalars per latent, a histogram with `num_bins` log-spaced bins per latent, and
+    the `top_n` largest activations of each latent along with the tokens they came
+    from. Tokens are identified by their index in the stream of tokens passed to
+    `update`, or -1 for empty slots.
+    """
+
+    def __init__(
+        self,
+        num_latents: int,
+        *,
+        top_n: int = 16,
+        num_bins: int = 64,
+        hist_range: tuple[float, float] = (1e-3, 1e3),
+        device: str | torch.device = "cpu",
+    ):
+        lo, hi = (math.log10(x) for x in hist_range)
+        self.bin_edges = torch.logspace(lo, hi, num_bins + 1, device=device)
+        self.num_tokens = 0
+
+        self.fire_counts = torch.zeros(num_latents, dtype=torch.long, device=device)
+        self.act_sum = torch.zeros(num_latents, dtype=torch.float64, device=device)
+        self.act_max = torch.zeros(num_latents, device=device)
+        self.histogram = torch.zeros(
+            num_latents, num_bins, dtype=torch.long, device=device
+        )
+        self.top_acts = torch.full((num_latents, top_n), -torch.inf, device=device)
+        self.top_tokens = torch.full(
+            (num_latents, top_n), -1, dtype=torch.long, device=device
+        )
+
+    @property
+    def num_latents(self) -> int:
+        return len(self.fire_counts)
+
+    @property
+    def top_n(self) -> int:
+        return self.top_acts.shape[1]
+
+    @property
+    def fire_freq(self) -> Tensor:
+        """Fraction of tokens on which each latent fired."""
+        return self.fire_counts / max(self.num_tokens, 1)
+
+    @property
+    def mean_act(self) -> Tensor:
+        """Mean activation of each latent over the tokens on which it fired."""
+        return (self.act_sum / self.fire_counts.clamp_min(1)).float()
+
+    @torch.no_grad()
+    def update(self, top_acts: Tensor, top_indices: Tensor):
+        """Add a batch of `(num_tokens, k)` SAE activations to the statistics."""
+        num_tokens, k = top_acts.shape
+        tokens = torch.arange(
+            self.num_tokens, self.num_tokens + num_tokens, device=top_acts.device
+        )
+        self.num_tokens += num_tokens
+
+        fired = top_acts.flatten() > 0
+        acts = top_acts.flatten()[fired].float()
+        latents = top_indices.flatten()[fired]
+        tokens = tokens.repeat_interleave(k)[fired]
+
+        ones = torch.ones_like(latents)
+        self.fire_counts.index_add_(0, latents, ones)
+        self.act_sum.index_add_(0, latents, acts.double())
+        self.act_max.scatter_reduce_(0, latents, acts, "amax")
+
+        bins = torch.bucketize(acts, self.bin_edges[1:-1])
+        num_bins = self.histogram.shape[1]
+        self.histogram.view(-1).index_add_(0, latents * num_bins + bins, ones)
+
+        # Sort by latent, and by descending activation within each latent, so that
+        # the rank of each activation within its latent is its offset from the start
+        # of the latent's run of entries
+        order = acts.argsort(descending=True)
+        order = order[latents[order].argsort(stable=True)]
+        acts, latents, tokens = acts[order], latents[order], tokens[order]
+
+        counts = torch.bincount(latents, minlength=self.num_latents)
+        starts = counts.cumsum(0) - counts
+        rank = torch.arange(len(latents), device=latents.device) - starts[latents]
+
+        # Only the top `top_n` of each latent in this batch can make it into the
+        # overall top `top_n`
+        keep = rank < self.top_n
+        acts, latents, tokens, rank = (x[keep] for x in (acts, latents, tokens, rank))
+
+        # Merge the candidates into the rows of the latents that fired
+        touched = latents[rank == 0]
+        rows = torch.searchsorted(touched, latents)
+        cand_acts = torch.full(
+            (len(touched), self.top_n), -torch.inf, device=acts.device
+        )
+        cand_tokens = torch.full_like(cand_acts, -1, dtype=torch.long)
+        cand_acts[rows, rank] = acts
+        cand_tokens[rows, rank] = tokens
+
+        merged_acts = torch.cat([self.top_acts[touched], cand_acts], dim=1)
+        merged_tokens = torch.cat([self.top_tokens[touched], cand_tokens], dim=1)
+        best, idx = merged_acts.topk(self.top_n, dim=1)
+        self.top_acts[touched] = best
+        self.top_tokens[touched] = merged_tokens.gather(1, idx)
+
+    def state_dict(self) -> dict[str, Tensor]:
+        return {
+            "fire_counts": self.fire_counts,
+            "act_sum": self.act_sum,
+            "act_max": self.act_max,
+            "histogram": self.histogram,
+            "top_acts": self.top_acts,
+            "top_tokens": self.top_tokens,
+            "bin_edges": self.bin_edges,
+            "num_tokens": torch.tensor(self.num_tokens),
+        }
+
+    def save(self, path: Path | str):
+        """Write the statistics to a safetensors file."""
+        save_file({k: v.contiguous().cpu() for k, v in self.state_dict().items()}, path)
+
+    @staticmethod
+    def load(path: Path | str, device: str | torch.device = "cpu") -> "LatentStats":
+        """Load statistics written by `save`."""
+        tensors = load_safetensors(path, device)
+        num_latents, num_bins = tensors["histogram"].shape
+
+        stats = LatentStats(
+            num_latents,
+            top_n=tensors["top_acts"].shape[1],
+            num_bins=num_bins,
+            device=device,
+        )
+        for key, value in tensors.items():
+            if key == "num_tokens":
+                stats.num_tokens = int(value)
+            else:
+                setattr(stats, key, value)
+
+        return stats
+
+
+@torch.no_grad()
+def collect_stats(
+    model: PreTrainedModel,
+    saes: dict[str, Sae],
+    batches: Iterable[Tensor],
+    *,
+    top_n: int = 16,
+    num_bins: int = 64,
+    hist_range: tuple[float, float] = (1e-3, 1e3),
+    writer: CodeWriter | None = None,
+    progress: bool = True,
+) -> dict[str, LatentStats]:
+    """Collect the statistics of every SAE in `saes` over batches of token ids.
+
+    `saes` is keyed by hookpoint, and the codes are computed by `iter_codes`. Token
+    indices in the results count tokens across all batches, so with batches of shape
+    `(batch_size, seq_len)` token `t` is position `t % seq_len` of sequence
+    `t // seq_len`.
+
+    If `writer` is given, the codes of every token are also exported with it, and it
+    is closed at the end.
+    """
+    stats = {
+        name: LatentStats(
+            sae.num_latents,
+            top_n=top_n,
+            num_bins=num_bins,
+            hist_range=hist_range,
+            device=sae.device,
+        )
+        for name, sae in saes.items()
+    }
+
+    codes = iter_codes(
+        model, saes, tqdm(batches, desc="Collecting stats", disable=not progress)
+    )
+    for batch_codes in codes:
+        for name, (top_acts, top_indices) in batch_codes.items():
+            stats[name].update(top_acts.flatten(0, -2), top_indices.flatten(0, -2))
+
+        if writer is not None:
+            writer.write(batch_codes)
+
+    if writer is not None:
+        writer.close()
+
+    return stats
+
+
+def save_stats(stats: dict[str, LatentStats], root: Path | str, **metadata):
+    """Write each hookpoint's statistics and a `stats.json` file describing them.
+
+    Keyword arguments are stored in `stats.json` as they are.
+    """
+    root = Path(root)
+    for name, s in stats.items():
+        root.joinpath(name).mkdir(parents=True, exist_ok=True)
+        s.save(root / name / "stats.safetensors")
+
+    first = next(iter(stats.values()))
+    with open(root / STATS_NAME, "w") as f:
+        json.dump(
+            {
+                **metadata,
+                "hookpoints": list(stats),
+                "num_tokens": first.num_tokens,
+                "top_n": first.top_n,
+                "bin_edges": first.bin_edges.tolist(),
+            },
+            f,
+            indent=2,
+        )
+
+
+def load_stats(
+    root: Path | str, device: str | torch.device = "cpu"
+) -> dict[str, LatentStats]:
+    """Load the statistics of every hookpoint written by `save_stats`."""
+    root = Path(root)
+    with open(root / STATS_NAME) as f:
+        hookpoints = json.load(f)["hookpoints"]
+
+    return {
+        name: LatentStats.load(root / name / "stats.safetensors", device)
+        for name in hookpoints
+    }
+
+
+def run():
+    from datasets import Dataset, load_dataset
+    from transformers import AutoModel, AutoTokenizer
+
+    from .data import chunk_and_tokenize
+
+    cfg = parse(StatsConfig)
+
+    model = AutoModel.from_pretrained(
+        cfg.model,
+        device_map={"": cfg.device},
+        torch_dtype=torch.bfloat16 if cfg.device != "cpu" else torch.float32,
+    )
+    model.eval()
+
+    if Path(cfg.saes).exists():
+        load_many = Sae.load_many_from_disk
+    else:
+        load_many = Sae.load_many_from_hub
+
+    saes = load_many(
+        cfg.saes,
+        cfg.device,
+        decoder=False,
+        hookpoints=cfg.hookpoints or None,
+    )
+
+    try:
+        dataset = load_dataset(cfg.dataset, split=cfg.split)
+    except ValueError as e:
+        # Automatically use load_from_disk if appropriate
+        if "load_from_disk" in str(e):
+            dataset = Dataset.load_from_disk(cfg.dataset, keep_in_memory=False)
+        else:
+            raise e
+
+    assert isinstance(dataset, Dataset)
+    if "input_ids" not in dataset.column_names:
+        tokenizer = AutoTokenizer.from_pretrained(cfg.model)
+        dataset = chunk_and_tokenize(dataset, tokenizer, max_seq_len=cfg.ctx_len)
+
+    dataset = dataset.with_format("torch", columns=["input_ids"])
+    if cfg.max_examples is not None:
+        dataset = dataset.select(range(min(cfg.max_examples, len(dataset))))
+
+    batches = (
+        dataset[i : i + cfg.batch_size]["input_ids"]
+        for i in range(0, len(dataset), cfg.batch_size)
+    )
+    writer = None
+    if cfg.codes_dir is not None:
+        writer = CodeWriter(
+            cfg.codes_dir,
+            {name: sae.num_latents for name, sae in saes.items()},
+            value_dtype=str_to_dtype(cfg.codes_dtype) if cfg.codes_dtype else None,
+        )
+
+    stats = collect_stats(
+        model,
+        saes,
+        prefetch(batches, 2),
+        top_n=cfg.top_n,
+        num_bins=cfg.num_bins,
+        hist_range=(cfg.hist_min, cfg.hist_max),
+        writer=writer,
+    )
+    save_stats(
+        stats,
+        cfg.output,
+        model=cfg.model,
+        saes=cfg.saes,
+        dataset=cfg.dataset,
+        split=cfg.split,
+        num_examples=len(dataset),
+        seq_len=dataset[0]["input_ids"].shape[-1],
+    )
+    print(f"Saved statistics for {len(stats)} hookpoints to '{cfg.output}'")
+
+
+if __name__ == "__main__":
+    run()
@@ -1,20 +1,37 @@
+import json
+import math
+import os
 from collections import defaultdict
+from contextlib import nullcontext
 from dataclasses import asdict
-from typing import Sized
+from fnmatch import fnmatchcase
+from itertools import accumulate, islice
+from typing import Iterator, Sized
 
 import torch
 import torch.distributed as dist
-from fnmatch import fnmatchcase
 from natsort import natsorted
 from torch import Tensor, nn
 from torch.nn.parallel import DistributedDataParallel as DDP
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, IterableDataset
 from tqdm.auto import tqdm
 from transformers import PreTrainedModel, get_linear_schedule_with_warmup
 
+from .cache import ActivationCache, ActivationCacheWriter
+from .checkpoint import CheckpointWriter, recover_checkpoint
 from .config import TrainConfig
 from .sae import Sae
-from .utils import geometric_median, get_layer_list, resolve_widths
+from .stacked import SaeGroup, StackedSae
+from .utils import (
+    HookpointCapture,
+    SyncCounter,
+    geometric_median,
+    get_layer_list,
+    load_safetensors,
+    plan_placement,
+    prefetch,
+    resolve_widths,
+)
 
 
 class SaeTrainer:
@@ -42,56 +59,101 @@ class SaeTrainer:
 
         self.cfg = cfg
         self.dataset = dataset
-        self.distribute_modules()
 
         N = len(cfg.hookpoints)
-        assert isinstance(dataset, Sized)
-        num_examples = len(dataset)
+        if isinstance(dataset, Sized):
+            num_examples = min(len(dataset), cfg.max_examples or len(dataset))
+        elif cfg.max_examples is not None:
+            num_examples = cfg.max_examples
+        else:
+            raise ValueError("`max_examples` must be set if the dataset has no length")
+
+        self.num_batches = math.ceil(num_examples / cfg.batch_size)
 
         device = model.device
         input_widths = resolve_widths(model, cfg.hookpoints)
-        unique_widths = set(input_widths.values())
+        self.distribute_modules(input_widths)
 
-        if cfg.distribute_modules and len(unique_widths) > 1:
-            # dist.all_to_all requires tensors to have the same shape across ranks
-            raise ValueError(
-                f"All modules must output tensors of the same shape when using "
-                f"`distribute_modules=True`, got {unique_widths}"
+        self.model = model
+        if cfg.distribute_modules:
+            # Every rank writes its own SAEs into a shared staging directory
+            session = [f"{os.getpid()}"]
+            dist.broadcast_object_list(session)
+            self.checkpointer = CheckpointWriter(
+                num_writers=dist.get_world_size(),
+                rank=dist.get_rank(),
+                session=session[0],
             )
+        else:
+            self.checkpointer = CheckpointWriter()
+
+        if cfg.sweep:
+            print(f"Sweeping over SAE configs: {list(cfg.sae_variants())}")
+        # SAEs are named after their hookpoint, prefixed by the variant name if we're
+        # sweeping over configs. Checkpoints are saved under the same names.
+        self.saes: dict[str, Sae] = {}
+        self.hookpoint_of: dict[str, str] = {}
+        lr_of: dict[str, float] = {}
+        for variant, sae_cfg in cfg.sae_variants().items():
+            for hook in self.local_hookpoints():
+                name = f"{variant}/{hook}" if variant else hook
+                sae = Sae(input_widths[hook], sae_cfg, device)
+                self.saes[name] = sae
+                self.hookpoint_of[name] = hook
 
-        self.model = model
-        self.saes = {
-            hook: Sae(input_widths[hook], cfg.sae, device)
-            for hook in self.local_hookpoints()
-        }
+                # Auto-select LR using 1 / sqrt(d) scaling law from Fig 3 of the paper
+                lr_of[name] = (
+                    cfg.sweep_lr.get(variant)
+                    or cfg.lr
+                    or 2e-4 / (sae.num_latents / (2**14)) ** 0.5
+                )
+
+        # Store SAEs of the same shape, and their gradients, in stacked buffers
+        self.group = SaeGroup(self.saes)
+        for names, stack in self.group.groups:
+            stack.init_grads([self.saes[name] for name in names])
 
         pgs = [
-            {
-                "params": sae.parameters(),
-                # Auto-select LR using 1 / sqrt(d) scaling law from Fig 3 of the paper
-                "lr": cfg.lr or 2e-4 / (sae.num_latents / (2**14)) ** 0.5
-            }
-            for sae in self.saes.values()
+            {"params": sae.parameters(), "lr": lr_of[name]}
+            for name, sae in self.saes.items()
         ]
         # Dedup the learning rates we're using, sort them, round to 2 decimal places
         lrs = [f"{lr:.2e}" for lr in sorted(set(pg["lr"] for pg in pgs))]
         print(f"Learning rates: {lrs}" if len(lrs) > 1 else f"Learning rate: {lrs[0]}")
 
-        try:
-            from bitsandbytes.optim import Adam8bit as Adam
+        if cfg.lazy_adam:
+            from .optim import LazyAdam as Adam
 
-            print("Using 8-bit Adam from bitsandbytes")
-        except ImportError:
-            from torch.optim import Adam
+            print("Using lazy Adam, updating only the latents that fired")
+        else:
+            try:
+                from bitsandbytes.optim import Adam8bit as Adam
+
+                print("Using 8-bit Adam from bitsandbytes")
+            except ImportError:
+                from torch.optim import Adam
 
-            print("bitsandbytes 8-bit Adam not available, using torch.optim.Adam")
-            print("Run `pip install bitsandbytes` for less memory usage.")
+                print("bitsandbytes 8-bit Adam not available, using torch.optim.Adam")
+                print("Run `pip install bitsandbytes` for less memory usage.")
 
         self.optimizer = Adam(pgs)
         self.lr_scheduler = get_linear_schedule_with_warmup(
             self.optimizer, cfg.lr_warmup_steps, num_examples // cfg.batch_size
         )
 
+        # Number of tokens since each latent last fired
+        self.num_tokens_since_fired = {
+            name: torch.zeros(sae.num_latents, device=device, dtype=torch.long)
+            for name, sae in self.saes.items()
+        }
+        # Number of times each latent has fired over the whole run, across all ranks
+        self.fire_counts = {
+            name: torch.zeros(sae.num_latents, device=device, dtype=torch.long)
+            for name, sae in self.saes.items()
+        }
+        # Number of batches consumed from the dataset so far
+        self.num_batches_seen = 0
+
     def fit(self):
         # Use Tensor Cores even for fp32 matmuls
         torch.set_float32_matmul_precision("high")
@@ -99,16 +161,18 @@ class SaeTrainer:
         rank_zero = not dist.is_initialized() or dist.get_rank() == 0
         ddp = dist.is_initialized() and not self.cfg.distribute_modules
 
-        if self.cfg.log_to_wandb and rank_zero:
+        # Every rank imports wandb, so that they all agree on whether to log
+        if self.cfg.log_to_wandb:
             try:
                 import wandb
 
-                wandb.init(
-                    name=self.cfg.run_name,
-                    project="sae",
-                    config=asdict(self.cfg),
-                    save_code=True,
-                )
+                if rank_zero:
+                    wandb.init(
+                        name=self.cfg.run_name,
+                        project="sae",
+                        config=asdict(self.cfg),
+                        save_code=True,
+                    )
             except ImportError:
                 print("Weights & Biases not installed, skipping logging.")
                 self.cfg.log_to_wandb = False
@@ -120,187 +184,388 @@ class SaeTrainer:
         print(f"Number of SAE parameters: {num_sae_params:_}")
         print(f"Number of model parameters: {num_model_params:_}")
 
+        if self.cfg.resume:
+            self.load_state(self.cfg.run_name or "checkpoints")
+
         device = self.model.device
-        dl = DataLoader(
-            self.dataset,
-            batch_size=self.cfg.batch_size,
-            shuffle=True,
+        cache = self.load_cache()
+        pbar = tqdm(
+            self.iter_activations(cache, start=self.num_batches_seen),
+            desc="Training",
+            disable=not rank_zero,
+            initial=self.num_batches_seen,
+            total=len(cache) if cache is not None else self.num_batches,
         )
-        pbar = tqdm(dl, desc="Training", disable=not rank_zero)
 
-        did_fire = {
-            name: torch.zeros(sae.num_latents, device=device, dtype=torch.bool)
-            for name, sae in self.saes.items()
-        }
-        num_tokens_since_fired = {
-            name: torch.zeros(sae.num_latents, device=device, dtype=torch.long)
-            for name, sae in self.saes.items()
-        }
+        # Number of times each latent fired during the current step. All hookpoints
+        # share one flat buffer, so they can be synchronized with a single collective.
+        sizes = [sae.num_latents for sae in self.saes.values()]
+        fire_buffer = torch.zeros(sum(sizes), device=device, dtype=torch.long)
+        step_fire_counts = dict(zip(self.saes, fire_buffer.split(sizes)))
+
+        # Train SAEs of the same shape together, or each one on its own
+        units: list[tuple[list[str], nn.Module]] = (
+            list(self.group.groups)
+            if self.cfg.stack_saes
+            else [([name], sae) for name, sae in self.saes.items()]
+        )
+        # Where each unit's fire counts start in the flat buffer
+        starts = dict(zip(self.saes, [0, *accumulate(sizes)]))
+        unit_offsets = [
+            torch.tensor([starts[name] for name in names], device=device)
+            for names, _ in units
+        ]
+
+        num_tokens_since_fired = self.num_tokens_since_fired
         num_tokens_in_step = 0
 
         # For logging purposes
         avg_auxk_loss = defaultdict(float)
         avg_fvu = defaultdict(float)
 
-        hidden_dict: dict[str, Tensor] = {}
-        name_to_module = {
-            name: self.model.get_submodule(name) for name in self.cfg.hookpoints
-        }
-        module_to_name = {v: k for k, v in name_to_module.items()}
+        # Activations sampled from the first few batches, for the decoder bias init
+        init_batches = max(self.cfg.b_dec_init_batches, 1)
+        init_points = defaultdict(list)
+        maybe_wrapped = None
 
-        def hook(module: nn.Module, _, outputs):
-            # Maybe unpack tuple outputs
-            if isinstance(outputs, tuple):
-                outputs = outputs[0]
+        # Optionally count the host-device syncs triggered by each step
+        syncs = SyncCounter() if self.cfg.debug_syncs else None
 
-            name = module_to_name[module]
-            hidden_dict[name] = outputs.flatten(0, 1)
+        with syncs or nullcontext():
+            for j, hidden_dict in enumerate(pbar, start=self.num_batches_seen):
+                batch_tokens = next(iter(hidden_dict.values())).shape[0]
 
-        for i, batch in enumerate(pbar):
-            hidden_dict.clear()
+                if self.cfg.distribute_modules:
+                    hidden_dict = self.scatter_hiddens(hidden_dict)
 
-            # Bookkeeping for dead feature detection
-            num_tokens_in_step += batch["input_ids"].numel()
+                if j < init_batches:
+                    for name, hiddens in hidden_dict.items():
+                        init_points[name].append(
+                            self.sample_points(hiddens, init_batches)
+                        )
 
-            # Forward pass on the model to get the next batch of activations            
-            handles = [
-                mod.register_forward_hook(hook) for mod in name_to_module.values()
-            ]
-            try:
-                with torch.no_grad():
-                    self.model(batch["input_ids"].to(device))
-            finally:
-                for handle in handles:
-                    handle.remove()
-
-            if self.cfg.distribute_modules:
-                hidden_dict = self.scatter_hiddens(hidden_dict)
-
-            for name, hiddens in hidden_dict.items():
-                raw = self.saes[name]  # 'raw' never has a DDP wrapper
-
-                # On the first iteration, initialize the decoder bias
-                if i == 0:
-                    # NOTE: The all-cat here could conceivably cause an OOM in some
-                    # cases, but it's unlikely to be a problem with small world sizes.
-                    # We could avoid this by "approximating" the geometric median
-                    # across all ranks with the mean (median?) of the geometric medians
-                    # on each rank. Not clear if that would hurt performance.
-                    median = geometric_median(self.maybe_all_cat(hiddens))
-                    raw.b_dec.data = median.to(raw.dtype)
+                    # These batches are only used to initialize the decoder bias
+                    if j < init_batches - 1:
+                        continue
 
+                    self.init_decoder_bias(init_points)
+                    init_points.clear()
+
+                if maybe_wrapped is None:
                     # Wrap the SAEs with Distributed Data Parallel. We have to do this
                     # after we set the decoder bias, otherwise DDP will not register
                     # gradients flowing to the bias after the first step.
-                    maybe_wrapped = (
-                        {
-                            name: DDP(sae, device_ids=[dist.get_rank()])
-                            for name, sae in self.saes.items()
-                        }
-                        if ddp
-                        else self.saes
-                    )
+                    device = self.model.device
+                    device_ids = [device.index] if device.type == "cuda" else None
+                    maybe_wrapped = [
+                        DDP(module, device_ids=device_ids) if ddp else module
+                        for _, module in units
+                    ]
 
-                # Make sure the W_dec is still unit-norm
-                if raw.cfg.normalize_decoder:
-                    raw.set_decoder_norm_to_unit_norm()
+                # Index of this batch among the ones we train on
+                i = j - init_batches + 1
+
+                # Bookkeeping for dead feature detection
+                num_tokens_in_step += batch_tokens
 
                 acc_steps = self.cfg.grad_acc_steps * self.cfg.micro_acc_steps
                 denom = acc_steps * self.cfg.wandb_log_frequency
-                wrapped = maybe_wrapped[name]
 
-                # Save memory by chunking the activations
-                for chunk in hiddens.chunk(self.cfg.micro_acc_steps):
-                    out = wrapped(
-                        chunk,
-                        dead_mask=(
-                            num_tokens_since_fired[name]
-                            > self.cfg.dead_feature_threshold
-                            if self.cfg.auxk_alpha > 0
-                            else None
-                        ),
-                    )
+                for (names, module), wrapped, offsets in zip(
+                    units, maybe_wrapped, unit_offsets
+                ):
+                    stacked = isinstance(module, StackedSae)
+                    if stacked:
+                        # Add a leading SAE dimension
+                        hiddens = torch.stack(
+                            [hidden_dict[self.hookpoint_of[name]] for name in names]
+                        )
+                        kwargs = {}
+                    else:
+                        hiddens = hidden_dict[self.hookpoint_of[names[0]]]
+                        kwargs = dict(
+                            block_size=self.cfg.encoder_block_size or None,
+                            sync_free=self.cfg.sync_free,
+                        )
 
-                    avg_fvu[name] += float(
-                        self.maybe_all_reduce(out.fvu.detach()) / denom
-                    )
+                    dead_mask = None
                     if self.cfg.auxk_alpha > 0:
-                        avg_auxk_loss[name] += float(
-                            self.maybe_all_reduce(out.auxk_loss.detach()) / denom
+                        masks = [
+                            num_tokens_since_fired[name]
+                            > self.cfg.dead_feature_threshold
+                            for name in names
+                        ]
+                        dead_mask = torch.stack(masks) if stacked else masks[0]
+
+                    # Save memory by chunking the activations
+                    for chunk in hiddens.chunk(self.cfg.micro_acc_steps, dim=-2):
+                        out = wrapped(chunk, dead_mask=dead_mask, **kwargs)
+
+                        # Accumulate on the device, and only reduce when we log
+                        fvus = out.fvu.detach().view(-1) / denom
+                        auxk_losses = out.auxk_loss.detach().view(-1) / denom
+                        for k, name in enumerate(names):
+                            avg_fvu[name] += fvus[k]
+                            if self.cfg.auxk_alpha > 0:
+                                avg_auxk_loss[name] += auxk_losses[k]
+
+                        loss = out.fvu + self.cfg.auxk_alpha * out.auxk_loss
+                        loss.sum().div(acc_steps).backward()
+
+                        # Count how many times each latent fired. Unlike bincount,
+                        # index_add_ never reads the max index back to the host.
+                        indices = out.latent_indices.reshape(len(names), -1)
+                        indices = (indices + offsets[:, None]).flatten()
+                        fire_buffer.index_add_(0, indices, torch.ones_like(indices))
+
+                # Check if we need to actually do a training step
+                step, substep = divmod(i + 1, self.cfg.grad_acc_steps)
+                if substep == 0:
+                    self.optimizer_step()
+
+                    ###############
+                    with torch.no_grad():
+                        # Sum the fire counts of every hookpoint across ranks at once
+                        self.maybe_all_reduce(fire_buffer, "sum")
+
+                        # Update the dead feature mask
+                        for name, counts in num_tokens_since_fired.items():
+                            counts += num_tokens_in_step
+                            counts.masked_fill_(step_fire_counts[name] > 0, 0)
+                            self.fire_counts[name] += step_fire_counts[name]
+
+                        # Reset stats for this step
+                        num_tokens_in_step = 0
+                        fire_buffer.zero_()
+
+                    # Read the count before logging, whose own sync is then charged
+                    # to the next step rather than mixed into the logged value
+                    if syncs is not None:
+                        step_syncs, syncs.count = syncs.count, 0
+                        pbar.set_postfix(syncs=step_syncs)
+
+                    if (
+                        self.cfg.log_to_wandb
+                        and (step + 1) % self.cfg.wandb_log_frequency == 0
+                    ):
+                        metrics = {}
+                        for name in self.saes:
+                            mask = (
+                                num_tokens_since_fired[name]
+                                > self.cfg.dead_feature_threshold
+                            )
+                            metrics[f"fvu/{name}"] = avg_fvu[name]
+                            metrics[f"dead_pct/{name}"] = mask.mean(dtype=torch.float32)
+                            if self.cfg.auxk_alpha > 0:
+                                metrics[f"auxk/{name}"] = avg_auxk_loss[name]
+
+                        # Reduce and read back all of the metrics at once
+                        values = torch.stack([v.float() for v in metrics.values()])
+                        info = dict(
+                            zip(metrics, self.maybe_all_reduce(values).tolist())
                         )
+                        if syncs is not None:
+                            info["syncs_per_step"] = step_syncs
+
+                        # Copying the fire counts to the host is slow, so we log
+                        # histograms of them much less often
+                        hist_freq = self.cfg.wandb_histogram_frequency
+                        for name in self.saes if (step + 1) % hist_freq == 0 else ():
+                            # Every token activates exactly k latents
+                            counts = self.fire_counts[name]
+                            num_tokens = (
+                                counts.sum().clamp_min(1) / self.saes[name].cfg.k
+                            )
+                            freqs = (counts / num_tokens).clamp_min(1e-10).log10()
+                            info[f"log_fire_freq/{name}"] = wandb.Histogram(
+                                freqs.cpu().numpy()
+                            )
+
+                        avg_auxk_loss.clear()
+                        avg_fvu.clear()
+
+                        if self.cfg.distribute_modules:
+                            outputs = [{} for _ in range(dist.get_world_size())]
+                            dist.gather_object(info, outputs if rank_zero else None)
+                            info.update(
+                                {k: v for out in outputs for k, v in out.items()}
+                            )
+
+                        if rank_zero:
+                            wandb.log(info, step=step)
+
+                    self.num_batches_seen = j + 1
+                    if (step + 1) % self.cfg.save_every == 0:
+                        self.save()
+
+        self.save()
+        pbar.close()
 
-                    loss = out.fvu + self.cfg.auxk_alpha * out.auxk_loss
-                    loss.div(acc_steps).backward()
+        # Make sure every rank has finished writing the final checkpoint
+        self.checkpointer.close()
+        if dist.is_initialized():
+            dist.barrier()
 
-                    # Update the did_fire mask
-                    did_fire[name][out.latent_indices.flatten()] = True
-                    self.maybe_all_reduce(did_fire[name], "max")  # max is boolean "any"
+    def optimizer_step(self):
+        """Clip and project the gradients, step, then renormalize the decoders.
+
+        All of the maintenance happens on the stacked parameters and gradients, so it
+        takes a handful of batched ops per stack rather than several per SAE.
+        """
+        stacks = [stack for _, stack in self.group.groups]
+        for stack in stacks:
+            # Clip gradient norm independently for each SAE
+            stack.clip_grad_norm_(1.0)
+
+            if stack.cfg.normalize_decoder:
+                stack.remove_gradient_parallel_to_decoder_directions()
+
+        self.optimizer.step()
+        self.lr_scheduler.step()
+
+        for stack in stacks:
+            # The SAEs' gradients are views into the stack, so don't free them
+            stack.zero_grad(set_to_none=False)
+
+            # Make sure the W_dec is still unit-norm
+            if stack.cfg.normalize_decoder:
+                stack.set_decoder_norm_to_unit_norm()
+
+    def sample_points(self, hiddens: Tensor, num_batches: int) -> Tensor:
+        """Randomly sample this batch's share of the points for the geometric median."""
+        budget = max(self.cfg.b_dec_init_points // num_batches, 1)
+        if len(hiddens) <= budget:
+            return hiddens
+
+        perm = torch.randperm(len(hiddens), device=hiddens.device)
+        return hiddens[perm[:budget]]
+
+    def init_decoder_bias(self, points: dict[str, list[Tensor]]):
+        """Initialize each decoder bias to the geometric median of its activations.
+
+        Every rank keeps its own bounded sample of points, and the Weiszfeld iterations
+        are all-reduced across ranks, so memory and compute stay flat as the world size
+        grows.
+        """
+        medians = {
+            hook: geometric_median(
+                torch.cat(chunks),
+                reduce=lambda x: self.maybe_all_reduce(x, "sum"),
+            )
+            for hook, chunks in points.items()
+        }
+        for name, sae in self.saes.items():
+            sae.b_dec.data.copy_(medians[self.hookpoint_of[name]])
 
-                # Clip gradient norm independently for each SAE
-                torch.nn.utils.clip_grad_norm_(raw.parameters(), 1.0)
+    def cache_path(self) -> str | None:
+        """Directory holding this rank's activation cache, if caching is enabled."""
+        if self.cfg.cache_dir is None:
+            return None
 
-            # Check if we need to actually do a training step
-            step, substep = divmod(i + 1, self.cfg.grad_acc_steps)
-            if substep == 0:
-                if self.cfg.sae.normalize_decoder:
-                    for sae in self.saes.values():
-                        sae.remove_gradient_parallel_to_decoder_directions()
+        if dist.is_initialized():
+            return f"{self.cfg.cache_dir}/rank_{dist.get_rank()}"
 
-                self.optimizer.step()
-                self.optimizer.zero_grad()
-                self.lr_scheduler.step()
+        return self.cfg.cache_dir
 
-                ###############
-                with torch.no_grad():
-                    # Update the dead feature mask
-                    for name, counts in num_tokens_since_fired.items():
-                        counts += num_tokens_in_step
-                        counts[did_fire[name]] = 0
-
-                    # Reset stats for this step
-                    num_tokens_in_step = 0
-                    for mask in did_fire.values():
-                        mask.zero_()
-
-                if (
-                    self.cfg.log_to_wandb
-                    and (step + 1) % self.cfg.wandb_log_frequency == 0
-                ):
-                    info = {}
+    def load_cache(self) -> ActivationCache | None:
+        """Open the activation cache for reading, if a complete one exists."""
+        path = self.cache_path()
+        if path is None or not ActivationCache.exists(path):
+            return None
 
-                    for name in self.saes:
-                        mask = (
-                            num_tokens_since_fired[name]
-                            > self.cfg.dead_feature_threshold
-                        )
+        cache = ActivationCache(path)
+        if set(cache.hookpoints) != set(self.cfg.hookpoints):
+            raise ValueError(
+                f"Activation cache at '{path}' holds hookpoints "
+                f"{list(cache.hookpoints)}, but we are training on "
+                f"{self.cfg.hookpoints}. Use a different `cache_dir`."
+            )
 
-                        info.update(
-                            {
-                                f"fvu/{name}": avg_fvu[name],
-                                f"dead_pct/{name}": mask.mean(
-                                    dtype=torch.float32
-                                ).item(),
-                            }
-                        )
-                        if self.cfg.auxk_alpha > 0:
-                            info[f"auxk/{name}"] = avg_auxk_loss[name]
+        print(f"Reading cached activations from '{path}'")
+        return cache
+
+    def iter_activations(
+        self, cache: ActivationCache | None = None, start: int = 0
+    ) -> Iterator[dict[str, Tensor]]:
+        """Yield the activations at each hookpoint, one dictionary per batch.
 
-                    avg_auxk_loss.clear()
-                    avg_fvu.clear()
+        If `cache` is given, activations are streamed from disk and the model is never
+        run. Otherwise we run the model, writing the activations to `cache_dir` as we
+        go if it is set. The first `start` batches are skipped, without running the
+        model on them.
+        """
+        device = self.model.device
 
-                    if self.cfg.distribute_modules:
-                        outputs = [{} for _ in range(dist.get_world_size())]
-                        dist.gather_object(info, outputs if rank_zero else None)
-                        info.update({k: v for out in outputs for k, v in out.items()})
+        # Page-locked host memory lets us overlap host-to-device copies with compute
+        pin = device.type == "cuda"
+
+        if cache is not None:
+            # Reading the pages of the memory map happens in the background thread
+            host_batches = (
+                {
+                    name: hiddens.pin_memory() if pin else hiddens
+                    for name, hiddens in hidden_dict.items()
+                }
+                for hidden_dict in cache.iter_batches(start)
+            )
+            for hidden_dict in prefetch(host_batches, self.cfg.prefetch_batches):
+                yield {
+                    name: hiddens.to(device, non_blocking=True)
+                    for name, hiddens in hidden_dict.items()
+                }
+            return
 
-                    if rank_zero:
-                        wandb.log(info, step=step)
+        # A cache has to cover the whole run, so we can't start one partway through
+        path = self.cache_path() if start == 0 else None
+        writer = ActivationCacheWriter(path) if path is not None else None
+        if writer is not None:
+            print(f"Caching activations to '{path}'")
+
+        if isinstance(self.dataset, IterableDataset):
+            # Streaming datasets can't be shuffled, and we can only skip ahead by
+            # reading through them. At least we don't have to run the model.
+            sampler = None
+            batch_range = (start, self.num_batches)
+        else:
+            # Shuffle with a fixed seed, so that we can resume from the same position
+            generator = torch.Generator().manual_seed(self.cfg.seed)
+            order = torch.randperm(len(self.dataset), generator=generator)
+            sampler = order[start * self.cfg.batch_size :].tolist()
+            batch_range = (0, self.num_batches - start)
 
-                if (step + 1) % self.cfg.save_every == 0:
-                    self.save()
+        num_workers = self.cfg.dataloader_num_workers
+        dl = DataLoader(
+            self.dataset,
+            batch_size=self.cfg.batch_size,
+            sampler=sampler,
+            num_workers=num_workers,
+            pin_memory=pin,
+            prefetch_factor=(
+                (self.cfg.prefetch_batches or None) if num_workers else None
+            ),
+            persistent_workers=num_workers > 0,
+        )
 
-        self.save()
-        pbar.close()
+        # Install the hooks once for the whole run. They're removed when the
+        # generator is exhausted or closed.
+        with HookpointCapture(self.model, self.cfg.hookpoints) as capture:
+            # Fetch and collate batches in a background thread, so that the model
+            # never has to wait on the dataset
+            batches = prefetch(islice(dl, *batch_range), self.cfg.prefetch_batches)
+            for batch in batches:
+                # Forward pass on the model to get the next batch of activations
+                with torch.no_grad():
+                    outputs = capture(batch["input_ids"].to(device, non_blocking=True))
+
+                hidden_dict = {name: x.flatten(0, 1) for name, x in outputs.items()}
+                if writer is not None:
+                    writer.write(hidden_dict)
+
+                yield hidden_dict
+
+        # Only mark the cache as complete once we've made it through the dataset
+        if writer is not None:
+            writer.close()
 
     def local_hookpoints(self) -> list[str]:
         return (
@@ -334,50 +599,143 @@ class SaeTrainer:
 
         return x
 
-    def distribute_modules(self):
+    def distribute_modules(self, input_widths: dict[str, int]):
         """Prepare a plan for distributing modules across ranks."""
         if not self.cfg.distribute_modules:
             self.module_plan = []
             print(f"Training on modules: {self.cfg.hookpoints}")
             return
 
-        layers_per_rank, rem = divmod(len(self.cfg.hookpoints), dist.get_world_size())
-        assert rem == 0, "Number of modules must be divisible by world size"
+        # Rough cost of a training step for the SAEs on each hookpoint, dominated by
+        # the encoder matmul and the sparse decoder, which scale with d_in times the
+        # number of latents and d_in times k respectively.
+        costs = {
+            hook: sum(
+                d_in * (sae_cfg.num_latents or d_in * sae_cfg.expansion_factor)
+                + d_in * sae_cfg.k
+                for sae_cfg in self.cfg.sae_variants().values()
+            )
+            for hook, d_in in input_widths.items()
+        }
+        self.module_plan = plan_placement(costs, dist.get_world_size())
 
-        # Each rank gets a subset of the layers
-        self.module_plan = [
-            self.cfg.hookpoints[start : start + layers_per_rank]
-            for start in range(0, len(self.cfg.hookpoints), layers_per_rank)
-        ]
+        total = sum(costs.values())
         for rank, modules in enumerate(self.module_plan):
-            print(f"Rank {rank} modules: {modules}")
+            share = sum(costs[hook] for hook in modules) / total
+            print(f"Rank {rank} modules ({share:.0%} of compute): {modules}")
 
     def scatter_hiddens(self, hidden_dict: dict[str, Tensor]) -> dict[str, Tensor]:
-        """Scatter & gather the hidden states across ranks."""
-        outputs = [
-            # Add a new leading "layer" dimension to each tensor
-            torch.stack([hidden_dict[hook] for hook in hookpoints], dim=1)
-            for hookpoints in self.module_plan
-        ]
+        """Scatter & gather the hidden states across ranks.
+
+        Each rank receives the hidden states of its own hookpoints from every rank,
+        concatenated along the batch dimension. Hookpoints may differ in width and
+        ranks may own different numbers of them, so we do one `all_to_all_single`
+        with uneven splits for each distinct width.
+        """
+        world_size = dist.get_world_size()
         local_hooks = self.module_plan[dist.get_rank()]
-        shape = next(iter(hidden_dict.values())).shape
-
-        # Allocate one contiguous buffer to minimize memcpys
-        buffer = outputs[0].new_empty(
-            # The (micro)batch size times the world size
-            shape[0] * dist.get_world_size(),
-            # The number of layers we expect to receive
-            len(local_hooks),
-            # All other dimensions
-            *shape[1:],
-        )
 
-        # Perform the all-to-all scatter
-        inputs = buffer.split([len(output) for output in outputs])
-        dist.all_to_all([x for x in inputs], outputs)
+        # All hookpoints share the same leading (batch and sequence) dimensions
+        first = next(iter(hidden_dict.values()))
+        leading = first.shape[:-1]
+        outputs = {}
 
-        # Return a list of results, one for each layer
-        return {hook: buffer[:, i] for i, hook in enumerate(local_hooks)}
+        for width in sorted({x.shape[-1] for x in hidden_dict.values()}):
+            plan = [
+                [hook for hook in hooks if hidden_dict[hook].shape[-1] == width]
+                for hooks in self.module_plan
+            ]
+            recv_hooks = plan[dist.get_rank()]
+            numel = leading.numel() * width
+
+            # Stack the layers we send to each rank along a new dimension after the
+            # batch dimension, directly into one flat send buffer
+            send_sizes = [numel * len(hooks) for hooks in plan]
+            send = first.new_empty(sum(send_sizes))
+            for hooks, chunk in zip(plan, send.split(send_sizes)):
+                if hooks:
+                    torch.stack(
+                        [hidden_dict[hook] for hook in hooks],
+                        dim=1,
+                        out=chunk.view(leading[0], len(hooks), *leading[1:], width),
+                    )
+
+            # Allocate one contiguous buffer to minimize memcpys
+            buffer = first.new_empty(
+                # The (micro)batch size times the world size
+                leading[0] * world_size,
+                # The number of layers of this width we expect to receive
+                len(recv_hooks),
+                # All other dimensions
+                *leading[1:],
+                width,
+            )
+            dist.all_to_all_single(
+                buffer.view(-1),
+                send,
+                output_split_sizes=[numel * len(recv_hooks)] * world_size,
+                input_split_sizes=send_sizes,
+            )
+            outputs.update({hook: buffer[:, i] for i, hook in enumerate(recv_hooks)})
+
+        # Return a dict of results, in the order of the plan
+        return {hook: outputs[hook] for hook in local_hooks}
+
+    def state_dir(self) -> str:
+        """Checkpoint subdirectory holding this rank's training state."""
+        # Under DDP every rank has the same state, so only rank 0 saves it
+        rank = dist.get_rank() if self.cfg.distribute_modules else 0
+        return f"training_state/rank_{rank}"
+
+    def state_dict(self) -> dict:
+        """Everything besides the SAE weights that we need to resume training."""
+        return {
+            "optimizer": self.optimizer.state_dict(),
+            "lr_scheduler": self.lr_scheduler.state_dict(),
+            "num_tokens_since_fired": self.num_tokens_since_fired,
+            "fire_counts": self.fire_counts,
+            "num_batches_seen": self.num_batches_seen,
+        }
+
+    def load_state(self, path: str):
+        """Restore the SAEs and training state from a checkpoint written by `save`."""
+        if not dist.is_initialized() or dist.get_rank() == 0:
+            recover_checkpoint(path)
+        if dist.is_initialized():
+            dist.barrier()
+
+        # Only complete checkpoints have a manifest, and it's written last
+        try:
+            with open(f"{path}/checkpoint.json") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            raise FileNotFoundError(
+                f"No complete checkpoint found in '{path}'"
+            ) from None
+
+        device = self.model.device
+        state = torch.load(f"{path}/{self.state_dir()}/state.pt", map_location=device)
+        if state["num_batches_seen"] != manifest["num_batches_seen"]:
+            raise ValueError(
+                f"Training state in '{path}' is from batch {state['num_batches_seen']}"
+                f", but the checkpoint is from batch {manifest['num_batches_seen']}"
+            )
+
+        for hook, sae in self.saes.items():
+            sae.load_state_dict(
+                load_safetensors(f"{path}/{hook}/sae.safetensors", device)
+            )
+
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.lr_scheduler.load_state_dict(state["lr_scheduler"])
+        for name in self.saes:
+            self.num_tokens_since_fired[name].copy_(
+                state["num_tokens_since_fired"][name]
+            )
+            self.fire_counts[name].copy_(state["fire_counts"][name])
+
+        self.num_batches_seen = state["num_batches_seen"]
+        print(f"Resuming from '{path}' after {self.num_batches_seen} batches")
 
     def save(self):
         """Save the SAEs to disk."""
@@ -389,12 +747,16 @@ class SaeTrainer:
         ):
             print("Saving checkpoint")
 
-            for hook, sae in self.saes.items():
-                assert isinstance(sae, Sae)
-
-                path = self.cfg.run_name or "checkpoints"
-                sae.save_to_disk(f"{path}/{hook}")
-
-        # Barrier to ensure all ranks have saved before continuing
-        if dist.is_initialized():
-            dist.barrier()
+            # Files are written in the background, in the same format as `save_to_disk`
+            self.checkpointer.save(
+                self.cfg.run_name or "checkpoints",
+                {
+                    hook: {
+                        "sae.safetensors": sae.state_dict(),
+                        "cfg.json": {**sae.cfg.to_dict(), "d_in": sae.d_in},
+                    }
+                    for hook, sae in self.saes.items()
+                }
+                | {self.state_dir(): {"state.pt": self.state_dict()}},
+                manifest={"num_batches_seen": self.num_batches_seen},
+            )
@@ -1,8 +1,25 @@
+import json
 import os
-from typing import Any, Type, TypeVar, cast
+import threading
+import time
+import warnings
+from pathlib import Path
+from queue import Full, Queue
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Type,
+    TypeVar,
+    cast,
+)
 
 import torch
 from accelerate.utils import send_to_device
+from safetensors import safe_open
 from torch import Tensor, nn
 from transformers import PreTrainedModel
 
@@ -17,35 +34,321 @@ def assert_type(typ: Type[T], obj: Any) -> T:
     return cast(typ, obj)
 
 
+class StopForward(Exception):
+    """Raised by a forward hook to skip the rest of a model's forward pass."""
+
+
+class HookpointCapture:
+    """Capture the outputs of some of the submodules of a model.
+
+    Calling the capture runs the model on the given inputs and returns the output of
+    each hookpoint, keyed by name, with tuple outputs reduced to their first element.
+    The forward pass stops as soon as every hookpoint has been reached. Use as a
+    context manager, which installs the hooks on entry and removes them on exit.
+    """
+
+    def __init__(self, model: nn.Module, hookpoints: Iterable[str]):
+        self.model = model
+        self.module_to_name = {model.get_submodule(name): name for name in hookpoints}
+        self.outputs: dict[str, Tensor] = {}
+        self.handles = []
+
+    def __enter__(self) -> "HookpointCapture":
+        self.handles = [
+            mod.register_forward_hook(self._hook) for mod in self.module_to_name
+        ]
+        return self
+
+    def __exit__(self, *exc):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def __call__(self, *args, **kwargs) -> dict[str, Tensor]:
+        self.outputs = {}
+        try:
+            self.model(*args, **kwargs)
+        except StopForward:
+            pass
+
+        return self.outputs
+
+    def _hook(self, module: nn.Module, _, outputs):
+        # Maybe unpack tuple outputs
+        if isinstance(outputs, tuple):
+            outputs = outputs[0]
+
+        self.outputs[self.module_to_name[module]] = outputs
+
+        # Skip the rest of the model once we have everything we need
+        if len(self.outputs) == len(self.module_to_name):
+            raise StopForward
+
+
+class SyncCounter:
+    """Count host-device synchronizations using PyTorch's CUDA sync debug mode.
+
+    Only synchronizing CUDA operations are detected, so the count is always zero on
+    other devices. Use as a context manager, reading and resetting `count` as needed.
+    """
+
+    MESSAGE = "called a synchronizing CUDA operation"
+
+    def __init__(self):
+        self.count = 0
+        self._catcher = warnings.catch_warnings()
+
+    def __enter__(self) -> "SyncCounter":
+        self._catcher.__enter__()
+        warnings.filterwarnings("always", message=f".*{self.MESSAGE}")
+
+        # Count sync warnings instead of printing them, and pass the rest through
+        showwarning = warnings.showwarning
+
+        def count_sync(message, *args, **kwargs):
+            if self.MESSAGE in str(message):
+                self.count += 1
+            else:
+                showwarning(message, *args, **kwargs)
+
+        warnings.showwarning = count_sync
+        if torch.cuda.is_available():
+            torch.cuda.set_sync_debug_mode("warn")
+
+        return self
+
+    def __exit__(self, *exc):
+        if torch.cuda.is_available():
+            torch.cuda.set_sync_debug_mode("default")
+
+        self._catcher.__exit__(*exc)
+
+
+def dtype_to_str(dtype: torch.dtype) -> str:
+    """Convert a dtype to a string like `"bfloat16"`, for storing in JSON."""
+    return str(dtype).removeprefix("torch.")
+
+
+def str_to_dtype(name: str) -> torch.dtype:
+    """Inverse of `dtype_to_str`."""
+    dtype = getattr(torch, name, None)
+    if not isinstance(dtype, torch.dtype):
+        raise ValueError(f"Unknown dtype '{name}'")
+
+    return dtype
+
+
+def map_tensor(
+    path: Path | str, dtype: torch.dtype, shape: tuple[int, ...], offset: int = 0
+) -> Tensor:
+    """Memory-map a flat binary file as a tensor, without reading it into memory.
+
+    The mapping is private, so writing to the tensor does not modify the file. If
+    `offset` is nonzero, the tensor starts that many bytes into the file.
+    """
+    numel = 1
+    for size in shape:
+        numel *= size
+
+    if numel == 0:
+        return torch.empty(shape, dtype=dtype)
+
+    if offset == 0:
+        mapped = torch.from_file(str(path), shared=False, size=numel, dtype=dtype)
+        return mapped.view(shape)
+
+    # Map the header too, then reinterpret the bytes that come after it
+    nbytes = numel * dtype.itemsize
+    mapped = torch.from_file(
+        str(path), shared=False, size=offset + nbytes, dtype=torch.uint8
+    )[offset:]
+
+    # Reinterpreting bytes as a wider dtype requires aligned storage
+    if offset % dtype.itemsize:
+        mapped = mapped.clone()
+
+    return mapped.view(dtype).view(shape)
+
+
+# Names used for dtypes in safetensors file headers
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def load_safetensors(
+    path: Path | str,
+    device: str | torch.device = "cpu",
+    *,
+    keys: Iterable[str] | None = None,
+    mmap: bool = False,
+) -> dict[str, Tensor]:
+    """Load the tensors in a safetensors file, or only those named in `keys`.
+
+    If `mmap` is set, tensors are memory-mapped straight from the file instead of
+    being read eagerly, and pages are only read from disk when they are first used.
+    """
+    if not mmap:
+        with safe_open(str(path), framework="pt", device=str(device)) as f:
+            return {key: f.get_tensor(key) for key in keys or f.keys()}
+
+    with open(path, "rb") as f:
+        header_len = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_len))
+
+    header.pop("__metadata__", None)
+    tensors = {}
+    for key in keys or header:
+        info = header[key]
+        start, _ = info["data_offsets"]
+        tensors[key] = map_tensor(
+            path,
+            SAFETENSORS_DTYPES[info["dtype"]],
+            tuple(info["shape"]),
+            offset=8 + header_len + start,
+        ).to(device)
+
+    return tensors
+
+
+# Marks an on-disk export of tensors as complete, and describes its layout
+MANIFEST_NAME = "manifest.json"
+
+
+def write_tensor(f: BinaryIO, x: Tensor):
+    """Append the elements of `x` to a binary file in row-major order.
+
+    This is the inverse of `map_tensor`, given the same dtype and shape.
+    """
+    # Reinterpret as raw bytes, since numpy doesn't support bfloat16
+    raw = x.detach().contiguous().cpu().flatten().view(torch.uint8)
+    f.write(raw.numpy().data)
+
+
+def prefetch(iterable: Iterable[T], depth: int) -> Iterator[T]:
+    """Iterate over `iterable` in a background thread, up to `depth` items ahead."""
+    if depth <= 0:
+        yield from iterable
+        return
+
+    queue: Queue = Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        # Give up if the consumer has gone away, instead of blocking forever
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((None, e))
+        else:
+            put((done, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
 @torch.no_grad()
-def geometric_median(points: Tensor, max_iter: int = 100, tol: float = 1e-5):
-    """Compute the geometric median `points`. Used for initializing decoder bias."""
-    # Initialize our guess as the mean of the points
-    guess = points.mean(dim=0)
-    prev = torch.zeros_like(guess)
+def geometric_median(
+    points: Tensor,
+    max_iter: int = 100,
+    tol: float = 1e-5,
+    *,
+    reduce: Callable[[Tensor], Tensor] | None = None,
+):
+    """Compute the geometric median `points`. Used for initializing decoder bias.
 
-    # Weights for iteratively reweighted least squares
-    weights = torch.ones(len(points), device=points.device)
+    If `points` is split across processes, pass a `reduce` function that sums a
+    tensor in place across all of them. Each Weiszfeld iteration then all-reduces a
+    single vector, rather than gathering every point onto every process.
+    """
+    reduce = reduce or (lambda x: x)
+    d = points.shape[-1]
+
+    def weighted_mean(weights: Tensor) -> Tensor:
+        # Reduce the weighted sum and the total weight with a single collective
+        stats = torch.cat([weights @ points, weights.sum()[None]])
+        reduce(stats)
+        return stats[:d] / stats[d]
+
+    # Initialize our guess as the mean of the points
+    guess = weighted_mean(points.new_ones(len(points)))
+    eps = torch.finfo(points.dtype).eps
 
     for _ in range(max_iter):
         prev = guess
 
-        # Compute the weights
-        weights = 1 / torch.norm(points - guess, dim=1)
-
-        # Normalize the weights
-        weights /= weights.sum()
+        # Weights for iteratively reweighted least squares
+        weights = 1 / torch.norm(points - guess, dim=1).clamp_min(eps)
 
         # Compute the new geometric median
-        guess = (weights.unsqueeze(1) * points).sum(dim=0)
+        guess = weighted_mean(weights)
 
-        # Early stopping condition
+        # Early stopping condition. Every process has the same guess, so they all
+        # stop on the same iteration.
         if torch.norm(guess - prev) < tol:
             break
 
     return guess
 
 
+def plan_placement(costs: dict[str, float], num_ranks: int) -> list[list[str]]:
+    """Split modules across ranks so that each rank's total cost is roughly equal.
+
+    Uses the longest-processing-time heuristic: modules are assigned from most to
+    least expensive, each to the rank with the lowest total cost so far. The modules
+    on each rank are returned in the same order as in `costs`.
+    """
+    if len(costs) < num_ranks:
+        raise ValueError(
+            f"Cannot distribute {len(costs)} modules across {num_ranks} ranks"
+        )
+
+    loads = [0.0] * num_ranks
+    assignment: dict[str, int] = {}
+
+    # Ties are broken by the original order, so every rank computes the same plan
+    for name in sorted(costs, key=lambda name: -costs[name]):
+        rank = min(range(num_ranks), key=lambda r: (loads[r], r))
+        loads[rank] += costs[name]
+        assignment[name] = rank
+
+    return [[name for name in costs if assignment[name] == r] for r in range(num_ranks)]
+
+
 def get_layer_list(model: PreTrainedModel) -> tuple[str, nn.ModuleList]:
     """Get the list of layers to train SAEs on."""
     N = assert_type(int, model.config.num_hidden_layers)
@@ -61,32 +364,16 @@ def get_layer_list(model: PreTrainedModel) -> tuple[str, nn.ModuleList]:
 
 @torch.inference_mode()
 def resolve_widths(
-    model: PreTrainedModel, module_names: list[str], dim: int = -1,
+    model: PreTrainedModel,
+    module_names: list[str],
+    dim: int = -1,
 ) -> dict[str, int]:
     """Find number of output dimensions for the specified modules."""
-    module_to_name = {
-        model.get_submodule(name): name for name in module_names
-    }
-    shapes: dict[str, int] = {}
-
-    def hook(module, _, output):
-        # Unpack tuples if needed
-        if isinstance(output, tuple):
-            output, *_ = output
-
-        name = module_to_name[module]
-        shapes[name] = output.shape[dim]
-
-    handles = [
-        mod.register_forward_hook(hook) for mod in module_to_name
-    ]
     dummy = send_to_device(model.dummy_inputs, model.device)
-    try:
-        model(**dummy)
-    finally:
-        for handle in handles:
-            handle.remove()
-    
+    with HookpointCapture(model, module_names) as capture:
+        outputs = capture(**dummy)
+
+    shapes = {name: output.shape[dim] for name, output in outputs.items()}
     return shapes
 
 
@@ -97,19 +384,388 @@ def eager_decode(top_indices: Tensor, top_acts: Tensor, W_dec: Tensor):
     return acts @ W_dec.mT
 
 
+# Upper bound on the number of elements gathered at once by `gather_dot` and friends
+SPARSE_CHUNK_NUMEL = 2**24
+
+
+def gather_dot(indices: Tensor, rows: Tensor, vecs: Tensor) -> Tensor:
+    """Dot products `out[n, j] = rows[indices[n, j]] @ vecs[n]`, computed in chunks."""
+    k = indices.shape[-1]
+    d = rows.shape[-1]
+    out = vecs.new_empty(indices.shape)
+
+    step = max(1, SPARSE_CHUNK_NUMEL // (k * d))
+    for start in range(0, len(indices), step):
+        idx = indices[start : start + step]
+        active = rows.index_select(0, idx.flatten()).view(*idx.shape, d)
+        out[start : start + step] = torch.bmm(
+            active, vecs[start : start + step].unsqueeze(-1)
+        ).squeeze(-1)
+
+    return out
+
+
+def scatter_outer(
+    indices: Tensor, weights: Tensor, vecs: Tensor, num_rows: int
+) -> Tensor:
+    """Sum `weights[n, j] * vecs[n]` into row `indices[n, j]` of a zero matrix."""
+    k = indices.shape[-1]
+    d = vecs.shape[-1]
+    out = vecs.new_zeros(num_rows, d)
+
+    step = max(1, SPARSE_CHUNK_NUMEL // (k * d))
+    for start in range(0, len(indices), step):
+        idx = indices[start : start + step]
+        src = weights[start : start + step, :, None] * vecs[start : start + step, None]
+        out.index_add_(0, idx.flatten(), src.view(-1, d))
+
+    return out
+
+
+class SparseDecoder(torch.autograd.Function):
+    """Decoder which only touches the `k` active rows of `W_dec` for each token.
+
+    This is the CPU counterpart of `TritonDecoder`. The forward pass is a weighted
+    `embedding_bag` over the decoder rows, and the backward pass gathers (for the
+    activations) or scatters (for the decoder) those same rows in bounded chunks.
+    """
+
+    @staticmethod
+    def forward(ctx, top_indices: Tensor, top_acts: Tensor, W_dec: Tensor):
+        ctx.save_for_backward(top_indices, top_acts, W_dec)
+
+        # W_dec is passed transposed, like in the other implementations
+        k = top_indices.shape[-1]
+        out = nn.functional.embedding_bag(
+            top_indices.reshape(-1, k),
+            W_dec.mT,
+            per_sample_weights=top_acts.reshape(-1, k),
+            mode="sum",
+        )
+        return out.view(*top_indices.shape[:-1], W_dec.shape[0])
+
+    @staticmethod
+    def backward(ctx, grad_output: Tensor):
+        top_indices, top_acts, W_dec = ctx.saved_tensors
+        k = top_indices.shape[-1]
+        d_in, num_latents = W_dec.shape
+
+        indices = top_indices.reshape(-1, k)
+        grad_output = grad_output.reshape(-1, d_in)
+
+        acts_grad = dec_grad = None
+        if ctx.needs_input_grad[1]:
+            # Dot product of the output grad with each active decoder row
+            acts_grad = gather_dot(indices, W_dec.mT, grad_output).view_as(top_acts)
+        if ctx.needs_input_grad[2]:
+            # Scatter the output grad, scaled by each activation, into the rows
+            acts = top_acts.reshape(-1, k)
+            dec_grad = scatter_outer(indices, acts, grad_output, num_latents).mT
+
+        return None, acts_grad, dec_grad
+
+
+# Gather-based implementation of SAE decoder, for use on CPU
+def sparse_decode(top_indices: Tensor, top_acts: Tensor, W_dec: Tensor):
+    return SparseDecoder.apply(top_indices, top_acts, W_dec)
+
+
+class GatheredLinear(torch.autograd.Function):
+    """Linear layer evaluated only at outputs `indices[n]` for each input row `n`.
+
+    Computes `out[n, j] = x[n] @ weight[indices[n, j]] + bias[indices[n, j]]`. The
+    backward pass only touches the selected rows of `weight`, so its cost scales with
+    the number of indices rather than the number of output features.
+    """
+
+    @staticmethod
+    def forward(
+        ctx,
+        x: Tensor,
+        weight: Tensor,
+        bias: Tensor,
+        indices: Tensor,
+        values: Tensor | None = None,
+    ):
+        ctx.save_for_backward(x, weight, indices)
+
+        # The values are usually known already, from selecting the indices
+        if values is None:
+            values = gather_dot(indices, weight, x) + bias[indices]
+
+        return values
+
+    @staticmethod
+    def backward(ctx, grad_output: Tensor):
+        x, weight, indices = ctx.saved_tensors
+        grad_output = grad_output.contiguous()
+
+        x_grad = weight_grad = bias_grad = None
+        if ctx.needs_input_grad[0]:
+            # This is exactly an SAE decoder pass, with `weight` as the dictionary
+            x_grad = decoder_impl(indices, grad_output, weight.mT)
+        if ctx.needs_input_grad[1]:
+            weight_grad = scatter_outer(indices, grad_output, x, len(weight))
+        if ctx.needs_input_grad[2]:
+            bias_grad = grad_output.new_zeros(len(weight)).index_add_(
+                0, indices.flatten(), grad_output.flatten()
+            )
+
+        return x_grad, weight_grad, bias_grad, None, None
+
+
+@torch.no_grad()
+def blocked_topk(
+    x: Tensor,
+    weight: Tensor,
+    bias: Tensor,
+    k: int,
+    block_size: int,
+    *,
+    signed: bool = False,
+    aux_k: int = 0,
+    aux_mask: Tensor | None = None,
+) -> tuple[tuple[Tensor, Tensor], tuple[Tensor, Tensor] | None]:
+    """Top-k of the SAE pre-activations `x @ weight.T + bias` for each row of `x`.
+
+    The output features are computed `block_size` at a time and merged into a running
+    top-k, so memory usage is bounded by the block size instead of the number of
+    features. Features are ranked by `relu(pre_acts)`, or by `pre_acts.abs()` if
+    `signed` is set.
+
+    If `aux_k` is positive, we also find the top `aux_k` features among those where
+    `aux_mask` is True, ranked by `relu(pre_acts)` (or `pre_acts` if `signed`), in the
+    same pass.
+
+    Returns:
+        A tuple `((values, indices), aux)`, where `values` holds the raw pre-activations
+        of the selected features and `aux` is `(values, indices)` for the auxiliary
+        selection, or `None` if `aux_k` is zero.
+    """
+    selections = [(k, None, True)]
+    if aux_k > 0:
+        assert aux_mask is not None, "Must pass `aux_mask` along with `aux_k`"
+        selections.append((aux_k, aux_mask, False))
+
+    # Running (scores, values, indices) for each selection
+    running = [
+        (
+            x.new_empty(len(x), 0),
+            x.new_empty(len(x), 0),
+            torch.empty(len(x), 0, device=x.device, dtype=torch.long),
+        )
+        for _ in selections
+    ]
+
+    for start in range(0, len(weight), block_size):
+        end = min(start + block_size, len(weight))
+        block = torch.addmm(bias[start:end], x, weight[start:end].mT)
+        acts = block if signed else block.relu()
+
+        for i, (n, mask, main) in enumerate(selections):
+            scores = acts.abs() if signed and main else acts
+            if mask is not None:
+                scores = scores.masked_fill(~mask[None, start:end], -torch.inf)
+
+            # Keep only the block's best candidates before merging, to save memory
+            scores, idx = scores.topk(min(n, end - start), sorted=False)
+            values = block.gather(-1, idx)
+
+            prev_scores, prev_values, prev_idx = running[i]
+            scores = torch.cat([prev_scores, scores], dim=-1)
+            values = torch.cat([prev_values, values], dim=-1)
+            idx = torch.cat([prev_idx, idx + start], dim=-1)
+
+            scores, best = scores.topk(min(n, scores.shape[-1]), sorted=False)
+            running[i] = (scores, values.gather(-1, best), idx.gather(-1, best))
+
+    (_, values, indices), *aux = running
+    return (values, indices), ((aux[0][1], aux[0][2]) if aux else None)
+
+
 # Triton implementation of SAE decoder
 def triton_decode(top_indices: Tensor, top_acts: Tensor, W_dec: Tensor):
     return TritonDecoder.apply(top_indices, top_acts, W_dec)
 
 
+class DecoderBackend(NamedTuple):
+    fn: Callable[[Tensor, Tensor, Tensor], Tensor]
+    """Function taking `(top_indices, top_acts, W_dec)` and returning the output."""
+
+    device_types: tuple[str, ...] | None
+    """Device types the backend supports, or `None` if it supports all of them."""
+
+
+class DecoderKey(NamedTuple):
+    """Everything that autotuning results are keyed on."""
+
+    num_tokens: int
+    k: int
+    d_in: int
+    num_latents: int
+    device: torch.device
+    dtype: torch.dtype
+    backward: bool
+
+
+DECODER_BACKENDS: dict[str, DecoderBackend] = {}
+"""All registered decoder backends, keyed by name."""
+
+# Backends to use when autotuning is off, in order of preference
+DEFAULT_DECODERS = ("triton", "sparse")
+
+# Either a backend name, "default" or "auto". Set from `SAE_DECODER` at import time
+_decoder_choice = "default"
+_autotune_cache: dict[DecoderKey, str] = {}
+
+
+def register_decoder(
+    name: str,
+    fn: Callable[[Tensor, Tensor, Tensor], Tensor],
+    device_types: tuple[str, ...] | None = None,
+):
+    """Register a decoder backend, making it available to `set_decoder`."""
+    DECODER_BACKENDS[name] = DecoderBackend(fn, device_types)
+    _autotune_cache.clear()
+
+
+def available_decoders(device: torch.device | str) -> list[str]:
+    """Names of the registered decoder backends that support `device`."""
+    device_type = torch.device(device).type
+    return [
+        name
+        for name, backend in DECODER_BACKENDS.items()
+        if backend.device_types is None or device_type in backend.device_types
+    ]
+
+
+def set_decoder(name: str):
+    """Choose the decoder backend used by `Sae.decode`.
+
+    Pass the name of a registered backend to always use it, `"default"` to use the
+    first available backend in `DEFAULT_DECODERS`, or `"auto"` to time every available
+    backend the first time each input shape is seen and use the fastest one. The
+    initial value can be set with the `SAE_DECODER` environment variable.
+    """
+    global _decoder_choice
+
+    if name not in ("default", "auto") and name not in DECODER_BACKENDS:
+        raise ValueError(
+            f"Unknown decoder '{name}'; expected 'default', 'auto' or one of "
+            f"{list(DECODER_BACKENDS)}"
+        )
+
+    _decoder_choice = name
+    _autotune_cache.clear()
+
+
+def get_decoder(top_indices: Tensor, top_acts: Tensor, W_dec: Tensor) -> str:
+    """Name of the decoder backend that would be used for these inputs."""
+    device = W_dec.device
+    if _decoder_choice not in ("default", "auto"):
+        if _decoder_choice not in available_decoders(device):
+            raise ValueError(
+                f"Decoder '{_decoder_choice}' does not support {device.type} tensors;"
+                f" expected one of {available_decoders(device)}"
+            )
+
+        return _decoder_choice
+
+    if _decoder_choice == "default":
+        available = available_decoders(device)
+        return next(name for name in DEFAULT_DECODERS if name in available)
+
+    key = DecoderKey(
+        num_tokens=top_indices[..., 0].numel(),
+        k=top_indices.shape[-1],
+        d_in=W_dec.shape[0],
+        num_latents=W_dec.shape[1],
+        device=device,
+        dtype=W_dec.dtype,
+        backward=torch.is_grad_enabled()
+        and (top_acts.requires_grad or W_dec.requires_grad),
+    )
+    if key not in _autotune_cache:
+        timings = {}
+        for name in available_decoders(device):
+            try:
+                timings[name] = time_decoder(
+                    DECODER_BACKENDS[name].fn,
+                    top_indices,
+                    top_acts,
+                    W_dec,
+                    backward=key.backward,
+                )
+            except Exception:
+                # Some backends only support certain shapes or layouts
+                continue
+
+        if timings:
+            _autotune_cache[key] = min(timings, key=timings.__getitem__)
+        else:
+            warnings.warn(
+                f"No decoder backend could be timed for {key}; falling back to eager"
+            )
+            _autotune_cache[key] = "eager"
+
+    return _autotune_cache[key]
+
+
+def autotune_results() -> dict[DecoderKey, str]:
+    """The backend chosen by autotuning for each input shape seen so far."""
+    return dict(_autotune_cache)
+
+
+def time_decoder(
+    fn: Callable[[Tensor, Tensor, Tensor], Tensor],
+    top_indices: Tensor,
+    top_acts: Tensor,
+    W_dec: Tensor,
+    *,
+    backward: bool = False,
+    repeats: int = 3,
+) -> float:
+    """Best-of-`repeats` wall clock time for a decoder, after one warmup call."""
+    # Fresh leaves sharing storage with the inputs, so we don't touch their grads
+    top_acts = top_acts.detach().requires_grad_(backward)
+    W_dec = W_dec.detach().requires_grad_(backward)
+
+    def sync():
+        if W_dec.device.type == "cuda":
+            torch.cuda.synchronize(W_dec.device)
+
+    times = []
+    with torch.enable_grad() if backward else torch.no_grad():
+        for _ in range(repeats + 1):
+            sync()
+            start = time.perf_counter()
+
+            out = fn(top_indices, top_acts, W_dec)
+            if backward:
+                out.backward(torch.ones_like(out))
+
+            sync()
+            times.append(time.perf_counter() - start)
+
+    return min(times[1:])
+
+
+def decoder_impl(top_indices: Tensor, top_acts: Tensor, W_dec: Tensor) -> Tensor:
+    """Decode using the backend chosen by `get_decoder`."""
+    name = get_decoder(top_indices, top_acts, W_dec)
+    return DECODER_BACKENDS[name].fn(top_indices, top_acts, W_dec)
+
+
+register_decoder("eager", eager_decode)
+register_decoder("sparse", sparse_decode)
+
 try:
     from .kernels import TritonDecoder
 except ImportError:
-    decoder_impl = eager_decode
-    print("Triton not installed, using eager implementation of SAE decoder.")
+    pass
 else:
-    if os.environ.get("SAE_DISABLE_TRITON") == "1":
-        print("Triton disabled, using eager implementation of SAE decoder.")
-        decoder_impl = eager_decode
-    else:
-        decoder_impl = triton_decode
+    if os.environ.get("SAE_DISABLE_TRITON") != "1":
+        register_decoder("triton", triton_decode, device_types=("cuda",))
+
+# Validate the environment variable now that every backend is registered
+set_decoder(os.environ.get("SAE_DECODER", "default"))
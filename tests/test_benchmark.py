@@ -0,0 +1,29 @@
+import torch
+
+from sae.benchmark import benchmark, benchmark_in_subprocess
+
+
+def test_benchmark_runs_on_cpu():
+    result = benchmark(16, 64, 4, 32, torch.float32, "cpu", warmup=0, repeats=1)
+
+    assert result["tokens_per_sec"] > 0
+    assert set(result["latency_ms"]) == {
+        "encode",
+        "select_topk",
+        "decode",
+        "forward",
+        "forward_auxk",
+        "backward",
+        "optimizer_step",
+        "train_step",
+    }
+
+
+def test_peak_memory_is_measured_per_point():
+    # Each point runs in a fresh process, so a small one reports less memory than a
+    # large one even when it runs afterwards
+    args = (4, 32, torch.float32, "cpu")
+    large = benchmark_in_subprocess("default", 512, 4096, *args, warmup=0, repeats=1)
+    small = benchmark_in_subprocess("default", 16, 64, *args, warmup=0, repeats=1)
+
+    assert 0 < small["peak_memory_bytes"] < large["peak_memory_bytes"]
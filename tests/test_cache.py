@@ -0,0 +1,38 @@
+import torch
+
+from sae.cache import ActivationCache, ActivationCacheWriter
+
+
+def test_cache_roundtrip(tmp_path):
+    batches = [
+        {
+            "layers.0": torch.randn(n, 8, dtype=torch.bfloat16),
+            "layers.1": torch.randn(n, 4),
+        }
+        for n in [6, 6, 3, 6, 2]
+    ]
+
+    writer = ActivationCacheWriter(tmp_path, shard_size=2)
+    for batch in batches:
+        writer.write(batch)
+
+    assert not ActivationCache.exists(tmp_path)
+    writer.close()
+    assert ActivationCache.exists(tmp_path)
+
+    cache = ActivationCache(tmp_path)
+    assert len(cache) == len(batches)
+    assert cache.num_shards == 3
+
+    for expected, actual in zip(batches, cache, strict=True):
+        assert expected.keys() == actual.keys()
+        for name in expected:
+            assert actual[name].dtype == expected[name].dtype
+            torch.testing.assert_close(actual[name], expected[name])
+
+    # Skipping ahead lands on the right batch, even in the middle of a shard
+    for start in range(len(batches) + 1):
+        resumed = list(cache.iter_batches(start))
+        assert len(resumed) == len(batches) - start
+        for expected, actual in zip(batches[start:], resumed):
+            torch.testing.assert_close(actual["layers.1"], expected["layers.1"])
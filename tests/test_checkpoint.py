@@ -0,0 +1,123 @@
+import time
+from itertools import count
+from pathlib import Path
+from threading import Barrier
+
+import torch
+
+from sae import Sae, SaeConfig
+from sae.checkpoint import CheckpointWriter, recover_checkpoint
+
+
+def test_checkpoint_writer(tmp_path):
+    root = tmp_path / "run"
+    saes = {
+        f"layers.{i}": Sae(16, SaeConfig(expansion_factor=2, k=4)) for i in range(3)
+    }
+    writer = CheckpointWriter(max_workers=2)
+
+    for _ in range(2):
+        # Overwrites the previous checkpoint
+        expected = {name: sae.b_dec.detach().clone() for name, sae in saes.items()}
+        writer.save(
+            root,
+            {
+                name: {
+                    "sae.safetensors": sae.state_dict(),
+                    "cfg.json": {**sae.cfg.to_dict(), "d_in": sae.d_in},
+                }
+                for name, sae in saes.items()
+            },
+        )
+
+        # Updates made after `save` returns must not leak into the checkpoint
+        for sae in saes.values():
+            torch.nn.init.normal_(sae.b_dec)
+
+        writer.wait()
+        loaded = Sae.load_many_from_disk(root)
+        assert list(loaded) == list(saes)
+        for name, sae in loaded.items():
+            torch.testing.assert_close(sae.b_dec, expected[name])
+
+    writer.close()
+    assert [p.name for p in tmp_path.iterdir()] == ["run"]  # staging is cleaned up
+
+
+def test_checkpoint_writers_share_root(tmp_path):
+    root = tmp_path / "run"
+    writers = [
+        CheckpointWriter(num_writers=2, rank=rank, session="test") for rank in range(2)
+    ]
+
+    for step in range(2):
+        for rank, writer in enumerate(writers):
+            writer.save(root, {f"rank_{rank}": {"step.json": step}})
+
+            # The root is only swapped in once every writer has finished
+            writer.wait()
+            assert (root / "rank_0").exists() == (step > 0 or rank == 1)
+
+        assert sorted(p.name for p in root.iterdir()) == ["rank_0", "rank_1"]
+        assert (root / "rank_0" / "step.json").read_text() == str(step)
+
+    for writer in writers:
+        writer.close()
+    assert [p.name for p in tmp_path.iterdir()] == ["run"]
+
+
+def test_checkpoint_writers_race(tmp_path, monkeypatch):
+    # Writers that finish at the same time must agree on which of them commits. Make
+    # both of them count every marker, and make the second one try to take the lock
+    # while the first one is swapping the root in.
+    root = tmp_path / "run"
+    glob, mkdir, rename = Path.glob, Path.mkdir, Path.rename
+    counting = Barrier(2, timeout=10)
+    lock_attempts = count()
+
+    def synced_glob(self, pattern):
+        if self != root:
+            counting.wait()
+        return glob(self, pattern)
+
+    def slow_mkdir(self, *args, **kwargs):
+        if self.name == ".commit" and next(lock_attempts) % 2:
+            time.sleep(0.01)
+        return mkdir(self, *args, **kwargs)
+
+    def slow_rename(self, target):
+        time.sleep(0.02)
+        return rename(self, target)
+
+    monkeypatch.setattr(Path, "glob", synced_glob)
+    monkeypatch.setattr(Path, "mkdir", slow_mkdir)
+    monkeypatch.setattr(Path, "rename", slow_rename)
+
+    writers = [
+        CheckpointWriter(num_writers=2, rank=rank, session="test") for rank in range(2)
+    ]
+    for step in range(10):
+        for rank, writer in enumerate(writers):
+            writer.save(root, {f"rank_{rank}": {"step.json": step}})
+        for writer in writers:
+            writer.wait()
+
+        assert sorted(p.name for p in root.iterdir()) == ["rank_0", "rank_1"]
+        for rank in range(2):
+            assert (root / f"rank_{rank}" / "step.json").read_text() == str(step)
+
+    for writer in writers:
+        writer.close()
+    assert [p.name for p in tmp_path.iterdir()] == ["run"]
+
+
+def test_recover_checkpoint(tmp_path):
+    # Interrupted right after moving the old root aside
+    root = tmp_path / "run"
+    staging = tmp_path / "run.tmp-123-4"
+    (staging / "layers.0").mkdir(parents=True)
+    (tmp_path / "run.tmp-123-4.old" / "layers.0").mkdir(parents=True)
+
+    recover_checkpoint(root)
+    assert (root / "layers.0").exists()
+    assert [p.name for p in tmp_path.iterdir()] == ["run"]
@@ -0,0 +1,103 @@
+import pytest
+import torch
+
+from sae.codes import CodeWriter, SparseCodes
+from sae.sae import EncoderOutput
+
+
+def test_code_roundtrip(tmp_path):
+    torch.manual_seed(0)
+    num_latents = {"layers.0": 1000, "layers.1": 100_000}
+    writer = CodeWriter(
+        tmp_path, num_latents, value_dtype=torch.bfloat16, shard_tokens=20
+    )
+
+    batches = []
+    for _ in range(4):
+        codes = {
+            name: EncoderOutput(torch.rand(2, 8, 4), torch.randint(0, n, (2, 8, 4)))
+            for name, n in num_latents.items()
+        }
+        writer.write(codes)
+        batches.append(codes)
+
+    # Documents don't have to line up with sequences
+    codes = {
+        name: EncoderOutput(torch.rand(10, 4), torch.randint(0, n, (10, 4)))
+        for name, n in num_latents.items()
+    }
+    writer.write(codes, doc_lengths=[3, 7])
+    batches.append(codes)
+    writer.close()
+
+    reader = SparseCodes(tmp_path)
+    assert len(reader) == 74
+    assert reader.num_shards == 3  # 32 + 32 + 10 tokens
+    assert reader.num_docs == 10
+    assert reader.doc_offsets.tolist()[-3:] == [64, 67, 74]
+
+    for name in num_latents:
+        expected_acts = torch.cat([b[name].top_acts.flatten(0, -2) for b in batches])
+        expected_indices = torch.cat(
+            [b[name].top_indices.flatten(0, -2) for b in batches]
+        )
+
+        acts, indices = reader.tokens(name, 0, len(reader))
+        assert indices.dtype == (torch.uint16 if name == "layers.0" else torch.int32)
+        assert acts.dtype == torch.bfloat16
+        assert torch.equal(indices.long(), expected_indices)
+        assert torch.equal(acts, expected_acts.bfloat16())
+
+        # A range within a single shard is a view of the whole mapped shard
+        acts, _ = reader.tokens(name, 33, 40)
+        assert acts.untyped_storage().nbytes() == 32 * 4 * 2
+
+        acts, indices = reader.document(name, 8)
+        assert torch.equal(indices.long(), expected_indices[64:67])
+
+
+def test_code_append(tmp_path):
+    torch.manual_seed(0)
+    num_latents = {"layers.0": 100}
+
+    def batch():
+        return {
+            "layers.0": EncoderOutput(
+                torch.rand(2, 8, 4), torch.randint(0, 100, (2, 8, 4))
+            )
+        }
+
+    writer = CodeWriter(tmp_path, num_latents, value_dtype=torch.bfloat16)
+    first = batch()
+    writer.write(first)
+    writer.close()
+
+    with pytest.raises(ValueError):
+        CodeWriter(tmp_path, {"layers.0": 200}, append=True)
+    with pytest.raises(ValueError):
+        CodeWriter(tmp_path, num_latents, value_dtype=torch.float16, append=True)
+
+    # The old export stays readable until the new one is complete
+    writer = CodeWriter(tmp_path, num_latents, append=True)
+    second = batch()
+    writer.write(second)
+    old = SparseCodes(tmp_path)
+    assert len(old) == 16 and old.num_docs == 2
+    assert old.doc_offsets.tolist() == [0, 8, 16]
+    writer.close()
+
+    new = SparseCodes(tmp_path)
+    assert len(new) == 32 and new.num_docs == 4
+    assert new.doc_offsets.tolist() == [0, 8, 16, 24, 32]
+
+    # Appended codes are stored in the dtype of the existing ones
+    acts, indices = new.tokens("layers.0", 0, 32)
+    assert acts.dtype == torch.bfloat16
+    for i, codes in enumerate([first, second]):
+        expected_acts, expected_indices = codes["layers.0"]
+        assert torch.equal(
+            acts[16 * i : 16 * (i + 1)], expected_acts.flatten(0, 1).bfloat16()
+        )
+        assert torch.equal(
+            indices[16 * i : 16 * (i + 1)].long(), expected_indices.flatten(0, 1)
+        )
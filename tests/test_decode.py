@@ -1,6 +1,15 @@
+import pytest
 import torch
 
-from sae.utils import eager_decode, triton_decode
+from sae.utils import (
+    autotune_results,
+    available_decoders,
+    eager_decode,
+    get_decoder,
+    set_decoder,
+    sparse_decode,
+    triton_decode,
+)
 
 
 def test_decode():
@@ -18,3 +27,58 @@ def test_decode():
     triton_res = triton_decode(top_idx, top_vals, W_dec.mT)
 
     torch.testing.assert_allclose(eager_res, triton_res)
+
+
+def test_sparse_decode():
+    batch = 7
+    d_in = 50
+    d_sae = 100
+    k = 10
+
+    latents = torch.rand(batch, d_sae, dtype=torch.float64)
+    W_dec = torch.randn(d_sae, d_in, dtype=torch.float64)
+    top_vals, top_idx = latents.topk(k)
+    grad_out = torch.randn(batch, d_in, dtype=torch.float64)
+
+    results = []
+    for decode in (eager_decode, sparse_decode):
+        vals = top_vals.clone().requires_grad_()
+        W = W_dec.clone().requires_grad_()
+
+        out = decode(top_idx, vals, W.mT)
+        out.backward(grad_out)
+        results.append((out, vals.grad, W.grad))
+
+    for expected, actual in zip(*results):
+        torch.testing.assert_close(actual, expected)
+
+
+def test_autotune_decoder():
+    latents = torch.rand(16, 100)
+    W_dec = torch.randn(100, 50)
+    top_vals, top_idx = latents.topk(10)
+
+    set_decoder("auto")
+    try:
+        name = get_decoder(top_idx, top_vals, W_dec.mT)
+        assert name in available_decoders("cpu")
+        assert name in autotune_results().values()
+    finally:
+        set_decoder("default")
+
+
+def test_autotune_falls_back_to_eager(monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("unsupported")
+
+    monkeypatch.setattr("sae.utils.time_decoder", fail)
+    latents = torch.rand(4, 20)
+    W_dec = torch.randn(20, 8)
+    top_vals, top_idx = latents.topk(3)
+
+    set_decoder("auto")
+    try:
+        with pytest.warns(UserWarning, match="falling back to eager"):
+            assert get_decoder(top_idx, top_vals, W_dec.mT) == "eager"
+    finally:
+        set_decoder("default")
@@ -0,0 +1,85 @@
+import torch
+
+from sae.codes import CodeWriter, SparseCodes
+from sae.index import LatentIndex, build_index
+from sae.sae import EncoderOutput
+
+
+def write_codes(root, num_batches, append=False, shard_tokens=40):
+    writer = CodeWriter(
+        root, {"layers.0": 64}, shard_tokens=shard_tokens, append=append
+    )
+    for _ in range(num_batches):
+        acts = torch.rand(2, 16, 4).sub(0.1).clamp_min(0)
+        indices = torch.rand(32, 64).argsort(dim=-1)[:, :4].view(2, 16, 4)
+        writer.write({"layers.0": EncoderOutput(acts, indices)})
+    writer.close()
+
+
+def test_latent_index(tmp_path):
+    torch.manual_seed(0)
+    codes_root, root = tmp_path / "codes", tmp_path / "index"
+
+    write_codes(codes_root, 5)
+    assert build_index(codes_root, root) == 3
+    assert build_index(codes_root, root) == 0
+
+    # Appending to the codes adds new shards, which are indexed incrementally
+    write_codes(codes_root, 3, append=True)
+    assert SparseCodes(codes_root).num_shards == 5
+    assert build_index(codes_root, root) == 2
+
+    acts, indices = SparseCodes(codes_root).tokens("layers.0", 0, 256)
+    index = LatentIndex(root)
+    assert index.num_postings("layers.0").sum() == (acts > 0).sum()
+
+    latents = [0, 17, 63]
+    top_acts, top_tokens = index.top("layers.0", latents, m=5)
+    assert top_acts.shape == top_tokens.shape == (3, 5)
+
+    for latent, row_acts, row_tokens in zip(latents, top_acts, top_tokens):
+        # Brute force over every token
+        mask = (indices == latent) & (acts > 0)
+        expected = acts[mask].sort(descending=True).values[:5]
+        torch.testing.assert_close(row_acts[: len(expected)], expected)
+
+        for act, token in zip(row_acts, row_tokens):
+            assert act in acts[token][indices[token] == latent]
+
+    single_acts, single_tokens = index.top("layers.0", 17, m=5)
+    assert torch.equal(single_acts, top_acts[1])
+    assert torch.equal(single_tokens, top_tokens[1])
+
+    # Latents that fired less than `m` times are padded
+    top_acts, top_tokens = index.top("layers.0", 0, m=200)
+    num = int(((indices == 0) & (acts > 0)).sum())
+    assert (top_tokens[num:] == -1).all() and (top_tokens[:num] >= 0).all()
+
+
+def test_latent_index_rebuilds_stale_segments(tmp_path):
+    torch.manual_seed(0)
+    codes_root, root = tmp_path / "codes", tmp_path / "index"
+
+    write_codes(codes_root, 5)
+    assert build_index(codes_root, root) == 3
+
+    # Exporting the codes again with different shards invalidates the whole index
+    write_codes(codes_root, 2, shard_tokens=20)
+    assert build_index(codes_root, root) == 2
+
+    index = LatentIndex(root)
+    assert [s["num_tokens"] for s in index.segments] == [32, 32]
+
+    acts, _ = SparseCodes(codes_root).tokens("layers.0", 0, 64)
+    assert index.num_postings("layers.0").sum() == (acts > 0).sum()
+
+    # So does exporting different codes again with the same shards
+    write_codes(codes_root, 2, shard_tokens=20)
+    assert build_index(codes_root, root) == 2
+
+    acts, indices = SparseCodes(codes_root).tokens("layers.0", 0, 64)
+    top_acts, top_tokens = LatentIndex(root).top("layers.0", 17, m=100)
+    mask = (indices == 17) & (acts > 0)
+    expected = acts[mask].sort(descending=True).values
+    torch.testing.assert_close(top_acts[: len(expected)], expected)
+    assert (top_tokens[len(expected) :] == -1).all()
@@ -0,0 +1,42 @@
+import torch
+
+from sae.optim import LazyAdam
+
+
+def test_lazy_adam_matches_adam_on_dense_grads():
+    torch.manual_seed(0)
+    params = [torch.randn(8, 4, requires_grad=True), torch.randn(4, requires_grad=True)]
+    copies = [p.detach().clone().requires_grad_() for p in params]
+
+    lazy = LazyAdam(params, lr=1e-2)
+    dense = torch.optim.Adam(copies, lr=1e-2)
+    for _ in range(5):
+        grads = [torch.randn_like(p) for p in params]
+        for p, q, g in zip(params, copies, grads):
+            p.grad, q.grad = g.clone(), g.clone()
+
+        lazy.step()
+        dense.step()
+
+    for p, q in zip(params, copies):
+        torch.testing.assert_close(p, q)
+
+
+def test_lazy_adam_skips_rows_without_grads():
+    torch.manual_seed(0)
+    param = torch.randn(8, 4, requires_grad=True)
+    opt = LazyAdam([param], lr=1e-2)
+
+    grad = torch.randn(8, 4)
+    grad[::2] = 0
+    for _ in range(3):
+        before = param.detach().clone()
+        param.grad = grad.clone()
+        opt.step()
+
+        torch.testing.assert_close(param[::2], before[::2], rtol=0, atol=0)
+        assert (param[1::2] != before[1::2]).all()
+
+    state = opt.state[param]
+    assert state["step"].tolist() == [0, 3] * 4
+    assert (state["exp_avg"][::2] == 0).all()
@@ -0,0 +1,119 @@
+import pytest
+import torch
+
+from sae import Sae, SaeConfig
+
+
+@pytest.mark.parametrize("signed", [False, True])
+def test_blocked_forward_matches_dense(signed: bool):
+    torch.manual_seed(0)
+    sae = Sae(16, SaeConfig(expansion_factor=8, k=6, signed=signed))
+    sae = sae.double()
+    torch.nn.init.normal_(sae.encoder.bias)
+    torch.nn.init.normal_(sae.b_dec, std=0.1)
+
+    x = torch.randn(20, 16, dtype=torch.float64)
+    dead_mask = torch.rand(sae.num_latents) < 0.3
+
+    results = []
+    for block_size in (None, 7):
+        sae.zero_grad()
+        out = sae(x, dead_mask=dead_mask, block_size=block_size)
+        (out.fvu + out.auxk_loss).backward()
+
+        # Top-k is unsorted, so put the latents in order of their indices
+        indices, order = out.latent_indices.sort(dim=-1)
+        results.append(
+            [
+                out.fvu,
+                out.auxk_loss,
+                indices,
+                out.latent_acts.gather(-1, order),
+                *[p.grad for p in sae.parameters()],
+            ]
+        )
+
+    for expected, actual in zip(*results):
+        torch.testing.assert_close(actual, expected)
+
+
+@pytest.mark.parametrize("block_size", [None, 7])
+@pytest.mark.parametrize("dead_frac", [0.0, 0.02, 0.5])
+def test_sync_free_forward_matches(block_size: int | None, dead_frac: float):
+    torch.manual_seed(0)
+    sae = Sae(16, SaeConfig(expansion_factor=8, k=6)).double()
+    x = torch.randn(20, 16, dtype=torch.float64)
+    dead_mask = torch.rand(sae.num_latents) < dead_frac
+
+    results = []
+    for sync_free in (False, True):
+        sae.zero_grad()
+        out = sae(x, dead_mask=dead_mask, block_size=block_size, sync_free=sync_free)
+        (out.fvu + out.auxk_loss).backward()
+        results.append([out.fvu, out.auxk_loss, *[p.grad for p in sae.parameters()]])
+
+    for expected, actual in zip(*results):
+        torch.testing.assert_close(actual, expected)
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_load_from_disk(tmp_path, mmap: bool):
+    sae = Sae(16, SaeConfig(expansion_factor=4, k=4))
+    torch.nn.init.normal_(sae.b_dec)
+    sae.save_to_disk(tmp_path)
+
+    loaded = Sae.load_from_disk(tmp_path, mmap=mmap)
+    assert loaded.state_dict().keys() == sae.state_dict().keys()
+    for name, param in loaded.state_dict().items():
+        torch.testing.assert_close(param, sae.state_dict()[name])
+
+    encoder_only = Sae.load_from_disk(tmp_path, decoder=False, mmap=mmap)
+    assert encoder_only.W_dec is None
+    torch.testing.assert_close(
+        encoder_only.encoder.weight, sae.encoder.weight, rtol=0, atol=0
+    )
+
+
+def test_load_from_disk_skips_initialization(tmp_path, monkeypatch):
+    # A decoder that isn't unit norm would be changed by a renormalization
+    sae = Sae(16, SaeConfig(expansion_factor=4, k=4))
+    sae.W_dec.data.mul_(3)
+    sae.save_to_disk(tmp_path)
+
+    init_devices = []
+    kaiming_uniform_ = torch.nn.init.kaiming_uniform_
+
+    def record_init(tensor, *args, **kwargs):
+        init_devices.append(tensor.device.type)
+        return kaiming_uniform_(tensor, *args, **kwargs)
+
+    def renorm(self):
+        raise AssertionError("Decoder was renormalized while loading")
+
+    monkeypatch.setattr(torch.nn.init, "kaiming_uniform_", record_init)
+    monkeypatch.setattr(Sae, "set_decoder_norm_to_unit_norm", renorm)
+
+    loaded = Sae.load_from_disk(tmp_path)
+    assert set(init_devices) == {"meta"}
+    for name, param in loaded.state_dict().items():
+        assert param.device.type == "cpu"
+        assert torch.equal(param, sae.state_dict()[name])
+
+
+def test_load_many_from_disk(tmp_path):
+    saes = {
+        f"layers.{i}": Sae(16, SaeConfig(expansion_factor=2, k=4)) for i in range(12)
+    }
+    for name, sae in saes.items():
+        sae.save_to_disk(tmp_path / name)
+
+    loaded = Sae.load_many_from_disk(tmp_path, max_workers=4)
+    assert list(loaded) == list(saes)  # naturally sorted
+    for name, sae in loaded.items():
+        torch.testing.assert_close(sae.W_dec, saes[name].W_dec)
+
+    subset = Sae.load_many_from_disk(
+        tmp_path, decoder=False, hookpoints=["layers.10", "layers.2"]
+    )
+    assert list(subset) == ["layers.2", "layers.10"]
+    assert all(sae.W_dec is None for sae in subset.values())
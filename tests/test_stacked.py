@@ -0,0 +1,103 @@
+import torch
+
+from sae import Sae, SaeConfig, SaeGroup, StackedSae
+
+
+def test_group_matches_individual_saes():
+    torch.manual_seed(0)
+    saes = {
+        f"layers.{i}": Sae(d_in, SaeConfig(expansion_factor=4, k=8))
+        for i, d_in in enumerate([16, 16, 32, 16])
+    }
+    for sae in saes.values():
+        torch.nn.init.normal_(sae.b_dec)
+        torch.nn.init.normal_(sae.encoder.bias)
+
+    hiddens = {name: torch.randn(3, 5, sae.d_in) for name, sae in saes.items()}
+    expected = {name: sae.encode(hiddens[name]) for name, sae in saes.items()}
+
+    group = SaeGroup(saes)
+    assert len(group.groups) == 2
+
+    codes = group.encode(hiddens)
+    assert list(codes) == list(saes)
+
+    for name, sae in saes.items():
+        # Top-k is unsorted, so compare the latents in order of their indices
+        exp_indices, order = expected[name].top_indices.sort(dim=-1)
+        act_indices, act_order = codes[name].top_indices.sort(dim=-1)
+        torch.testing.assert_close(act_indices, exp_indices)
+        torch.testing.assert_close(
+            codes[name].top_acts.gather(-1, act_order),
+            expected[name].top_acts.gather(-1, order),
+        )
+
+    outputs = group.decode(codes)
+    for name, sae in saes.items():
+        torch.testing.assert_close(outputs[name], sae.decode(*codes[name]))
+
+
+def test_stacked_grad_maintenance():
+    torch.manual_seed(0)
+    saes = [Sae(16, SaeConfig(expansion_factor=4, k=8)) for _ in range(3)]
+    copies = [Sae(16, SaeConfig(expansion_factor=4, k=8)) for _ in range(3)]
+    for sae, copy in zip(saes, copies):
+        copy.load_state_dict(sae.state_dict())
+
+    stack = StackedSae.from_saes(saes)
+    stack.init_grads(saes)
+
+    # Gradients of the individual SAEs accumulate into the stacked buffers
+    x = torch.randn(3, 10, 16)
+    for sae, copy, xi in zip(saes, copies, x):
+        # Scale so that some SAEs get clipped and others don't
+        sae(xi * 10).fvu.backward()
+        copy(xi * 10).fvu.backward()
+
+    assert saes[1].W_dec.grad.data_ptr() == stack.W_dec.grad[1].data_ptr()
+    torch.testing.assert_close(stack.W_dec.grad[2], copies[2].W_dec.grad)
+
+    stack.clip_grad_norm_(1.0)
+    stack.remove_gradient_parallel_to_decoder_directions()
+    for copy in copies:
+        torch.nn.utils.clip_grad_norm_(copy.parameters(), 1.0)
+        copy.remove_gradient_parallel_to_decoder_directions()
+
+    for sae, copy in zip(saes, copies):
+        for p, q in zip(sae.parameters(), copy.parameters()):
+            torch.testing.assert_close(p.grad, q.grad)
+
+
+def test_stacked_forward_matches_individual_saes():
+    torch.manual_seed(0)
+    saes = [Sae(16, SaeConfig(expansion_factor=4, k=8)).double() for _ in range(3)]
+    copies = [Sae(16, SaeConfig(expansion_factor=4, k=8)).double() for _ in range(3)]
+    for sae, copy in zip(saes, copies):
+        torch.nn.init.normal_(sae.b_dec, std=0.1)
+        copy.load_state_dict(sae.state_dict())
+
+    stack = StackedSae.from_saes(saes)
+    x = torch.randn(3, 10, 16, dtype=torch.float64)
+    # All dead, a few dead, and none dead
+    dead_mask = torch.rand(3, saes[0].num_latents) < torch.tensor([[1.0], [0.05], [0]])
+
+    out = stack(x, dead_mask=dead_mask)
+    (out.fvu + out.auxk_loss).sum().backward()
+
+    for i, copy in enumerate(copies):
+        expected = copy(x[i], dead_mask=dead_mask[i])
+        (expected.fvu + expected.auxk_loss).backward()
+
+        torch.testing.assert_close(out.fvu[i], expected.fvu)
+        torch.testing.assert_close(out.auxk_loss[i], expected.auxk_loss)
+        torch.testing.assert_close(stack.W_dec.grad[i], copy.W_dec.grad)
+        torch.testing.assert_close(stack.W_enc.grad[i], copy.encoder.weight.grad)
+        torch.testing.assert_close(stack.b_dec.grad[i], copy.b_dec.grad)
+
+
+def test_group_separates_configs_stacks_depend_on():
+    saes = {
+        "a": Sae(16, SaeConfig(expansion_factor=4, k=8)),
+        "b": Sae(16, SaeConfig(expansion_factor=4, k=8, normalize_decoder=False)),
+    }
+    assert len(SaeGroup(saes).groups) == 2
@@ -0,0 +1,58 @@
+import torch
+
+from sae import Sae, SaeConfig
+from sae.stats import LatentStats, collect_stats, load_stats, save_stats
+
+
+def test_latent_stats():
+    num_latents, top_n = 32, 4
+    stats = LatentStats(num_latents, top_n=top_n, num_bins=8, hist_range=(0.1, 10))
+
+    batches = []
+    for _ in range(3):
+        # Some activations are zero, which doesn't count as firing
+        acts = torch.rand(50, 6).mul(4).sub(0.5).clamp_min(0)
+        indices = torch.rand(50, num_latents).argsort(dim=-1)[:, :6]
+        stats.update(acts, indices)
+        batches.append((acts, indices))
+
+    acts = torch.cat([a for a, _ in batches]).flatten()
+    indices = torch.cat([i for _, i in batches]).flatten()
+    tokens = torch.arange(150).repeat_interleave(6)
+    assert stats.num_tokens == 150
+
+    for latent in range(num_latents):
+        mask = (indices == latent) & (acts > 0)
+        assert stats.fire_counts[latent] == mask.sum()
+        assert stats.histogram[latent].sum() == mask.sum()
+        torch.testing.assert_close(stats.act_sum[latent].float(), acts[mask].sum())
+
+        top = acts[mask].sort(descending=True).values[:top_n]
+        torch.testing.assert_close(stats.top_acts[latent, : len(top)], top)
+        assert (stats.top_tokens[latent, len(top) :] == -1).all()
+
+        # The stored tokens are the ones the activations came from
+        for act, token in zip(stats.top_acts[latent], stats.top_tokens[latent]):
+            if token >= 0:
+                assert act in acts[mask & (tokens == token)]
+
+
+def test_collect_stats(tmp_path):
+    from transformers import AutoModel, GPT2Config
+
+    torch.manual_seed(0)
+    model = AutoModel.from_config(
+        GPT2Config(n_layer=2, n_embd=16, n_head=2, vocab_size=50, n_positions=16)
+    ).eval()
+    saes = {f"h.{i}": Sae(16, SaeConfig(expansion_factor=2, k=4)) for i in range(2)}
+    batches = [torch.randint(0, 50, (2, 8)) for _ in range(3)]
+
+    stats = collect_stats(model, saes, batches, progress=False)
+    save_stats(stats, tmp_path, seq_len=8)
+    loaded = load_stats(tmp_path)
+
+    assert list(loaded) == ["h.0", "h.1"]
+    for name, s in loaded.items():
+        assert s.num_tokens == 48
+        for key, value in stats[name].state_dict().items():
+            torch.testing.assert_close(s.state_dict()[key], value)
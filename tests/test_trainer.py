@@ -0,0 +1,133 @@
+import json
+
+import pytest
+import torch
+from datasets import Dataset
+from transformers import AutoModel, GPT2Config
+
+from sae import Sae, SaeConfig, SaeTrainer, TrainConfig
+
+
+class Preempted(Exception):
+    pass
+
+
+def make_trainer(run_name, **kwargs) -> SaeTrainer:
+    torch.manual_seed(0)
+    model = AutoModel.from_config(
+        GPT2Config(n_layer=2, n_embd=16, n_head=2, vocab_size=50, n_positions=16)
+    ).eval()
+    dataset = Dataset.from_dict(
+        {"input_ids": torch.randint(0, 50, (32, 8)).tolist()}
+    ).with_format("torch")
+    cfg = TrainConfig(
+        SaeConfig(expansion_factor=4, k=4),
+        batch_size=4,
+        lr_warmup_steps=2,
+        auxk_alpha=1 / 32,
+        dead_feature_threshold=20,
+        save_every=2,
+        log_to_wandb=False,
+        run_name=str(run_name),
+        **kwargs,
+    )
+    return SaeTrainer(cfg, dataset, model)
+
+
+def test_resume_matches_uninterrupted_run(tmp_path):
+    full = make_trainer(tmp_path / "full")
+    full.fit()
+
+    # Stop halfway through, right after the second checkpoint is written
+    interrupted = make_trainer(tmp_path / "resumed")
+    save = interrupted.save
+    num_saves = 0
+
+    def save_then_stop():
+        nonlocal num_saves
+
+        save()
+        num_saves += 1
+        if num_saves == 2:
+            interrupted.checkpointer.wait()
+            raise Preempted
+
+    interrupted.save = save_then_stop
+    with pytest.raises(Preempted):
+        interrupted.fit()
+
+    resumed = make_trainer(tmp_path / "resumed", resume=True)
+    resumed.fit()
+
+    for name, sae in full.saes.items():
+        for key, value in sae.state_dict().items():
+            torch.testing.assert_close(
+                resumed.saes[name].state_dict()[key], value, rtol=0, atol=0
+            )
+
+    expected = full.optimizer.state_dict()["state"]
+    actual = resumed.optimizer.state_dict()["state"]
+    assert expected.keys() == actual.keys()
+    for idx, state in expected.items():
+        for key, value in state.items():
+            torch.testing.assert_close(actual[idx][key], value, rtol=0, atol=0)
+
+
+def test_resume_rejects_mismatched_state(tmp_path):
+    trainer = make_trainer(tmp_path / "run")
+    trainer.fit()
+
+    # Training state from a different step than the rest of the checkpoint
+    with open(tmp_path / "run" / "checkpoint.json", "w") as f:
+        json.dump({"num_batches_seen": 2}, f)
+
+    with pytest.raises(ValueError, match="from batch"):
+        make_trainer(tmp_path / "run").load_state(str(tmp_path / "run"))
+
+
+def test_sweep_variant_names():
+    cfg = TrainConfig(
+        SaeConfig(),
+        sweep=[
+            SaeConfig(expansion_factor=4, k=8),
+            SaeConfig(expansion_factor=4, k=16),
+            SaeConfig(expansion_factor=8, k=8),
+        ],
+    )
+    assert list(cfg.sae_variants()) == [
+        "expansion_factor=4,k=8",
+        "expansion_factor=4,k=16",
+        "expansion_factor=8,k=8",
+    ]
+    assert list(TrainConfig(SaeConfig()).sae_variants()) == [""]
+
+    with pytest.raises(ValueError):
+        TrainConfig(SaeConfig(), sweep=[SaeConfig(), SaeConfig()]).sae_variants()
+    with pytest.raises(ValueError):
+        TrainConfig(SaeConfig(), sweep_lr={"k=8": 1e-3})
+
+
+def test_sweep_fit(tmp_path):
+    sweep = [SaeConfig(expansion_factor=4, k=4), SaeConfig(expansion_factor=4, k=8)]
+    trainer = make_trainer(tmp_path / "run", sweep=sweep, sweep_lr={"k=8": 1e-3})
+    assert trainer.hookpoint_of == {
+        "k=4/h.0": "h.0",
+        "k=4/h.1": "h.1",
+        "k=8/h.0": "h.0",
+        "k=8/h.1": "h.1",
+    }
+
+    initial = {name: sae.W_dec.detach().clone() for name, sae in trainer.saes.items()}
+    trainer.fit()
+
+    for (name, sae), group in zip(trainer.saes.items(), trainer.optimizer.param_groups):
+        assert sae.cfg.k == (8 if name.startswith("k=8/") else 4)
+        assert not torch.equal(sae.W_dec, initial[name])
+        if name.startswith("k=8/"):
+            assert group["initial_lr"] == 1e-3
+        else:
+            assert group["initial_lr"] != 1e-3
+
+        # Each variant is saved separately, in the usual format
+        saved = Sae.load_from_disk(tmp_path / "run" / name)
+        torch.testing.assert_close(saved.W_dec, sae.W_dec)
@@ -0,0 +1,18 @@
+import pytest
+
+from sae.utils import plan_placement
+
+
+def test_plan_placement():
+    costs = {"embed": 1.0, "layers.0": 4.0, "layers.1": 4.0, "mlp.0": 16.0}
+    plan = plan_placement(costs, 3)
+
+    # Every module is placed exactly once, in the original order on each rank
+    assert sorted(sum(plan, [])) == sorted(costs)
+    assert all(hooks == [h for h in costs if h in hooks] for hooks in plan)
+
+    loads = sorted(sum(costs[h] for h in hooks) for hooks in plan)
+    assert loads == [4.0, 5.0, 16.0]
+
+    with pytest.raises(ValueError):
+        plan_placement(costs, 5)